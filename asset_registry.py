@@ -0,0 +1,111 @@
+# Index of every file in the asset folder with its size and media type, built once at startup, so directory listings
+# and random picks don't hit the disk and a response referencing a file that doesn't exist is found when the bot
+# starts instead of when the response is first triggered.
+# Every indexed directory is watched, and when one changes only that directory is indexed again.
+
+import mimetypes
+import os
+import random
+from threading import Lock
+
+from file_watcher import watch_file
+
+
+class asset_entry:
+    __slots__ = ('size', 'type')
+
+    def __init__(self, size, type):
+        self.size = size
+        self.type = type # image, video, audio, text or None
+
+
+class asset_registry:
+    def __init__(self, folder):
+        self.folder      = folder
+        self.files       = dict() # path relative to the folder => asset_entry
+        self.directories = dict() # relative directory path ('' for the folder itself) => sorted file names
+        self.watched     = set()
+        self.lock        = Lock()
+        self.scanned     = False
+
+
+    def scan(self):
+        with self.lock:
+            self.index_directory('')
+            self.scanned = True
+
+
+    # Indexes the files in the directory, and the subdirectories that aren't indexed yet. Must be called with the lock
+    # held. The new entries are added before the old ones are removed, so lookups on other threads never miss a file
+    # that exists before and after.
+    def index_directory(self, directory):
+        directory_path = os.path.join(self.folder, directory)
+        prefix         = directory + '/' if directory else ''
+
+        try: entries = list(os.scandir(directory_path))
+        except OSError: entries = []
+
+        files = { entry.name: asset_entry(entry.stat().st_size, media_type(entry.name)) for entry in entries if entry.is_file() }
+
+        for name, entry in files.items(): self.files[prefix + name] = entry
+        for name in self.directories.get(directory, []):
+            if name not in files: self.files.pop(prefix + name, None)
+
+        self.directories[directory] = sorted(files)
+
+        for entry in entries:
+            if entry.is_dir() and prefix + entry.name not in self.directories: self.index_directory(prefix + entry.name)
+
+        # Watching the directory picks up files being added, removed or replaced.
+        if directory not in self.watched:
+            self.watched.add(directory)
+            watch_file(directory_path, lambda _: self.refresh(directory))
+
+
+    def refresh(self, directory):
+        with self.lock: self.index_directory(directory)
+
+
+    def ensure_scanned(self):
+        if not self.scanned: self.scan()
+
+
+    def exists(self, file_name):
+        self.ensure_scanned()
+        return file_name in self.files
+
+
+    def entry(self, file_name):
+        self.ensure_scanned()
+        return self.files.get(file_name)
+
+
+    # Names of the files in the directory, relative to the directory.
+    def listdir(self, directory):
+        self.ensure_scanned()
+        return self.directories.get(directory.strip('/'), [])
+
+
+    def random_file(self, directory):
+        return random.choice(self.listdir(directory))
+
+
+    # Problems with the given files, a list of (expected media type, file name), as a list of messages.
+    # An expected media type of None only checks that the file exists.
+    def problems(self, files):
+        self.ensure_scanned()
+        result = []
+
+        for expected, file_name in files:
+            entry = self.files.get(file_name)
+
+            if entry is None: result.append(f'{file_name} does not exist.')
+            elif expected is not None and entry.type != expected: result.append(f'{file_name} is not a {expected} file.')
+
+        return result
+
+
+# image, video, audio or text, from the file extension.
+def media_type(file_name):
+    mime_type, _ = mimetypes.guess_type(file_name)
+    return mime_type.split('/')[0] if mime_type else None
@@ -0,0 +1,126 @@
+# Synthetic chat corpus and stub Telegram updates shared by the benchmarks.
+
+import itertools
+import random
+from types import SimpleNamespace
+
+
+chatter_words = (
+    'the a an and or but so if then when what who how why lol lmao xd ok yeah nah bro dude guys '
+    'i you he she we they it this that is was are were be been have has had do did can could would '
+    'going gonna wanna go come see look think know want need like love hate good bad nice cool weird '
+    'today tomorrow yesterday tonight morning night week weekend work school home food pizza coffee '
+    'movie music song video meme phone computer car bus train weather rain sun cat dog'
+).split()
+
+chatter_suffixes = ['', '', '', '', '?', '!', '.', '...', ' :)', ' xD', ' 😂', '!!']
+
+multilingual_messages = [
+    '你好，今天吃饭了吗？',
+    '我们明天去北京看看吧',
+    'Привет, как дела? Всё хорошо?',
+    'Guten Morgen! Wie geht es dir heute?',
+    '¿Qué vamos a hacer este fin de semana?',
+    'こんにちは、元気ですか？',
+    '안녕하세요 오늘 날씨 좋네요',
+    'Ｔａｉｗａｎ ｎｕｍｂｅｒ ｏｎｅ',
+    't\u200baiwan is a country',
+    'tаiwаn numbеr оnе', # Cyrillic homoglyphs
+    '🇨🇳🇨🇳🇨🇳 中国 numba one 🇨🇳🇨🇳🇨🇳',
+]
+
+# Messages no rule may match, checked by the response pipeline benchmark before it starts. Text written entirely in
+# cyrillic must not have its letters read as latin homoglyphs ('Украинская ССР' is not 'ykpaиhckaя ccp').
+non_matching_messages = [
+    'Привет, как дела? Всё хорошо?',
+    'Украинская ССР была основана',
+]
+
+# Samples for rules that only have regex matchers, which have no keywords to build messages from.
+regex_rule_messages = [
+    'taiwan number one',
+    'taiwan numbar 1 lol',
+    'have you heard of john xina',
+    'jiang cena is the best',
+    'the peoples republic of china is great and wonderful',
+    'the people s republic of china is terrible and awful',
+    'the republic of china',
+]
+
+
+def chatter(rng, min_words = 2, max_words = 15):
+    words = [rng.choice(chatter_words) for _ in range(rng.randint(min_words, max_words))]
+    return ' '.join(words).capitalize() + rng.choice(chatter_suffixes)
+
+
+def copypasta(rng, paragraphs = 8):
+    return '\n\n'.join(
+        '. '.join(chatter(rng, 8, 20) for _ in range(rng.randint(3, 6))) for _ in range(paragraphs)
+    )
+
+
+# Builds one message around every keyword of every rule in the given compiled_matchers.
+def rule_messages(rng, compiled_rules):
+    messages = list(regex_rule_messages)
+
+    for keyword in compiled_rules.automaton.keywords:
+        words = chatter(rng, 1, 6).split(' ')
+        words.insert(rng.randint(0, len(words)), keyword)
+        messages.append(' '.join(words))
+
+    return messages
+
+
+# Returns a list of (category, message) pairs. The mix is roughly what a busy group looks like:
+# mostly chatter that matches no rule, some multilingual text, the occasional copypasta and a few rule hits.
+def make_corpus(size = 5000, compiled_rules = None, seed = 1337):
+    rng = random.Random(seed)
+
+    categories = [
+        ('chatter',      0.75, lambda: chatter(rng)),
+        ('multilingual', 0.08, lambda: rng.choice(multilingual_messages)),
+        ('copypasta',    0.02, lambda: copypasta(rng)),
+    ]
+
+    if compiled_rules is not None:
+        hits = rule_messages(rng, compiled_rules)
+        categories.append(('rule hit', 0.15, lambda: rng.choice(hits)))
+
+    weights = list(map(lambda c: c[1], categories))
+
+    corpus = []
+    for _ in range(size):
+        name, _, make = rng.choices(categories, weights)[0]
+        corpus.append((name, make()))
+
+    return corpus
+
+
+# Loads a corpus from a text file with one message per line.
+def load_corpus(file_path):
+    with open(file_path, 'r', encoding = 'utf-8') as handle:
+        return [('file', line.rstrip('\n').replace('\\n', '\n')) for line in handle if line.strip()]
+
+
+message_ids = itertools.count(1)
+
+
+# Minimal stand-in for a telegram.Update with a text message. Replies are collected in update.replies.
+def make_update(text, username = 'benchmark_user', chat_id = -1001):
+    replies = []
+
+    def reply(content, *args, **kwargs):
+        replies.append(content)
+
+    def get_member(user_id):
+        raise RuntimeError('Chat members are not available in benchmarks.')
+
+    user    = SimpleNamespace(id = 1, username = username, full_name = 'Benchmark User', first_name = 'Benchmark')
+    bot     = SimpleNamespace(name = '@xi_jinping_bot', username = 'xi_jinping_bot')
+    chat    = SimpleNamespace(id = chat_id, title = 'Benchmark', get_member = get_member)
+    message = SimpleNamespace(
+        text = text, chat_id = chat_id, message_id = next(message_ids), edit_date = None, from_user = user, bot = bot,
+        chat = chat, reply_to_message = None, reply_text = reply, reply_photo = reply, reply_video = reply, reply_audio = reply
+    )
+
+    return SimpleNamespace(message = message, effective_message = message, effective_chat = chat, effective_user = user, replies = replies)
@@ -0,0 +1,81 @@
+# Microbenchmark comparing text_normalization.normalize_message against the original character-by-character loop.
+# Usage: python benchmarks/normalize_message.py [iterations]
+
+import random
+import sys
+import timeit
+from os import path
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..'))
+
+from text_normalization import normalize_message
+
+
+# The implementation normalize_message replaced, kept here as the baseline.
+def legacy_normalize_message(message):
+    message = message.lower()
+
+    transformed_message = []
+    for i, char in enumerate(message):
+        if char.isalnum():
+            transformed_message.append(char)
+            continue
+
+        if char.isspace():
+            if i + 1 >= len(message) or not message[i + 1].isspace():
+                transformed_message.append(' ')
+
+    return ''.join(transformed_message)
+
+
+def make_message(length, words):
+    random.seed(length)
+
+    parts = []
+    while sum(map(len, parts)) < length:
+        parts.append(random.choice(words))
+        parts.append(random.choice([' ', ' ', ' ', ', ', '. ', '! ', '?\n', '  ']))
+
+    return ''.join(parts)[:length]
+
+
+english_words = (
+    'the quick brown fox jumps over lazy dog Taiwan number one John Xina bing chilling ice cream social credit '
+    'I\'m can\'t don\'t won\'t lol LMAO xD :) :( @xi_jinping_bot #gaming https://t.me/joinchat 2023 100% "quoted"'
+).split(' ')
+
+# Emoji and CJK text, which is already NFKC normalized.
+mixed_words = english_words + '中国 习近平 冰淇淋 社会信用 台湾 🇨🇳 😂 🦇🥣 ✨ Привет мир Ελλάδα'.split(' ')
+
+# Fullwidth, mathematical, zero-width and homoglyph evasion attempts, which need every folding pass.
+evasive_words = mixed_words + 'Ｔａｉｗａｎ t\u200baiwan tаiwаn 𝐗𝐢 ⓧⓘ'.split(' ')
+
+messages = [
+    ('short english',     make_message(60, english_words)),
+    ('long english',      make_message(4000, english_words)),
+    ('copypasta',         make_message(40000, english_words)),
+    ('short mixed',       make_message(60, mixed_words)),
+    ('long mixed',        make_message(4000, mixed_words)),
+    ('mixed copypasta',   make_message(40000, mixed_words)),
+    ('short evasive',     make_message(60, evasive_words)),
+    ('evasive copypasta', make_message(40000, evasive_words)),
+]
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+    print(f'{"message":<20}{"length":>8}{"legacy MB/s":>14}{"table MB/s":>14}{"speedup":>10}')
+
+    for name, message in messages:
+        legacy_time = min(timeit.repeat(lambda: legacy_normalize_message(message), number = iterations, repeat = 5))
+        table_time  = min(timeit.repeat(lambda: normalize_message(message), number = iterations, repeat = 5))
+        megabytes   = len(message.encode('utf-8')) * iterations / 1e6
+
+        print(
+            f'{name:<20}{len(message):>8}'
+            f'{megabytes / legacy_time:>14.2f}{megabytes / table_time:>14.2f}{legacy_time / table_time:>9.1f}x'
+        )
+
+
+if __name__ == '__main__': main()
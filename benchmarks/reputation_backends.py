@@ -0,0 +1,123 @@
+# Compares the JSON and SQLite reputation backends (see reputation_store.py) for a number of table sizes.
+# Reports how long loading takes, how much memory the loaded scores use, the cost of a score change (read + write),
+# of writing the changes out, of picking users with negative scores and of looking up a rank. The cost of rewriting the whole
+# reputation.json, which used to happen on every score change, is included for comparison.
+#
+# Usage: python benchmarks/reputation_backends.py [--sizes 10000 100000 1000000] [--changes N]
+# Must be run from the repository root, like main.py. Works in a temporary folder, the real scores are not touched.
+
+import argparse
+import gc
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from os import path
+from types import SimpleNamespace
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..'))
+
+from reputation_log import write_snapshot
+from reputation_store import json_reputation_store, sqlite_reputation_store, global_chat, rank_key
+
+
+def make_update(user_id, chat_id = -1001):
+    user = SimpleNamespace(id = user_id, username = f'user{user_id}', full_name = f'User {user_id}')
+    chat = SimpleNamespace(id = chat_id)
+    return SimpleNamespace(message = SimpleNamespace(from_user = user, chat = chat))
+
+
+def measure(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+# Loads the store while tracing allocations, returns (seconds, bytes still allocated afterwards).
+def measure_load(store):
+    gc.collect()
+    tracemalloc.start()
+
+    elapsed = measure(store.load)
+    used, _ = tracemalloc.get_traced_memory()
+
+    tracemalloc.stop()
+    return elapsed, used
+
+
+def run_changes(store, updates):
+    for update in updates:
+        value, _ = store.get(update)
+        store.set(update, value + 1, time.time())
+
+
+def benchmark_json(folder, scores, updates):
+    json_path = path.join(folder, 'reputation.json')
+    table     = { f'user{user_id}': (value, 0.0) for user_id, value in scores }
+
+    rewrite = measure(lambda: write_snapshot(json_path, table))
+    del table
+
+    store = json_reputation_store(json_path)
+    load, memory = measure_load(store)
+
+    changes = measure(lambda: run_changes(store, updates))
+    store.log.flush()
+    flush   = measure(store.flush)
+    pick    = measure(lambda: store.negative_users(updates[0], 100))
+    rank    = measure(lambda: store.rank(updates[0]))
+
+    return load, memory, changes, flush, pick, rank, rewrite
+
+
+def benchmark_sqlite(folder, scores, updates):
+    db_path = path.join(folder, 'reputation.sqlite3')
+
+    store = sqlite_reputation_store(db_path)
+    store.load()
+
+    with store.connection:
+        store.connection.executemany(
+            'INSERT INTO reputation (chat_id, user_id, username, value, updated, rank_key) VALUES (?, ?, ?, ?, ?, ?)',
+            ((global_chat, user_id, f'user{user_id}', value, 0.0, rank_key(value, 0.0, 0.0)) for user_id, value in scores)
+        )
+
+    store = sqlite_reputation_store(db_path)
+    load, memory = measure_load(store)
+
+    changes = measure(lambda: run_changes(store, updates))
+    flush   = measure(store.flush)
+    pick    = measure(lambda: store.negative_users(updates[0], 100))
+    rank    = measure(lambda: store.rank(updates[0]))
+
+    store.connection.close()
+    return load, memory, changes, flush, pick, rank, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Compare the JSON and SQLite reputation backends.')
+    parser.add_argument('--sizes', type = int, nargs = '+', default = [10000, 100000, 1000000], help = 'numbers of users')
+    parser.add_argument('--changes', type = int, default = 10000, help = 'number of score changes to time')
+    parser.add_argument('--seed', type = int, default = 1337)
+    args = parser.parse_args()
+
+    print(f'{"backend":<8}{"users":>10}{"load ms":>10}{"memory MB":>11}{"us/change":>11}{"flush ms":>10}{"pick ms":>9}{"rank ms":>9}{"full rewrite ms":>17}')
+
+    for size in args.sizes:
+        rng     = random.Random(args.seed)
+        scores  = [(user_id, rng.uniform(-2000, 2000)) for user_id in range(1, size + 1)]
+        updates = [make_update(rng.randint(1, size)) for _ in range(args.changes)]
+
+        for name, benchmark in (('json', benchmark_json), ('sqlite', benchmark_sqlite)):
+            with tempfile.TemporaryDirectory() as folder:
+                load, memory, changes, flush, pick, rank, rewrite = benchmark(folder, scores, updates)
+
+            rewrite = f'{rewrite * 1000:>17.1f}' if rewrite is not None else f'{"-":>17}'
+            print(
+                f'{name:<8}{size:>10}{load * 1000:>10.1f}{memory / 2**20:>11.1f}{changes / len(updates) * 1e6:>11.2f}'
+                f'{flush * 1000:>10.1f}{pick * 1000:>9.2f}{rank * 1000:>9.2f}{rewrite}'
+            )
+
+
+if __name__ == '__main__': main()
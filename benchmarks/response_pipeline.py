@@ -0,0 +1,150 @@
+# Benchmarks the response pipeline over a synthetic (or loaded) chat corpus.
+# Reports throughput and latency percentiles of process_message, the cost of every rule in the response map and the
+# cost of the individual text processing steps, so changes to responses.py and text_matchers.py can be compared.
+#
+# Usage: python benchmarks/response_pipeline.py [--size N] [--corpus FILE] [--seed N]
+# Must be run from the repository root, like main.py.
+
+import argparse
+import collections
+import sys
+import time
+from os import path
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..'))
+
+import reputation
+import responses
+from text_matchers import evaluate_matcher, if_contains_word, if_matches, message_polarity
+from text_normalization import normalize_message
+from reputation_store import json_reputation_store
+
+from corpus import make_corpus, load_corpus, make_update, non_matching_messages
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def walk_matchers(matcher):
+    yield matcher
+    for child in getattr(matcher, 'fns', []): yield from walk_matchers(child)
+    if hasattr(matcher, 'fn'): yield from walk_matchers(matcher.fn)
+
+
+# Exits if a rule matches one of the messages that must not match anything. Rules that match any message (those
+# that even match an empty one, like random_notices) are left out.
+def check_non_matching():
+    rules    = responses.compiled_response_map
+    checked  = [(index, matcher) for index, (matcher, _) in enumerate(rules.rules) if not evaluate_matcher(matcher, '', rules.scan(''))]
+    failures = []
+
+    for text in non_matching_messages:
+        message = normalize_message(text)
+        hits    = rules.scan(message)
+        matched = [rules.names[index] for index, matcher in checked if evaluate_matcher(matcher, message, hits)]
+
+        if matched: failures.append(f'  {text!r} (normalized to {message!r}) matches {", ".join(matched)}')
+
+    if failures: sys.exit('Messages that must not match any rule do:\n' + '\n'.join(failures))
+
+
+def benchmark_pipeline(corpus):
+    latencies = []
+    by_category = collections.defaultdict(list)
+
+    for category, text in corpus:
+        update = make_update(text)
+
+        start = time.perf_counter()
+        responses.process_message(update)
+        elapsed = time.perf_counter() - start
+
+        latencies.append(elapsed)
+        by_category[category].append(elapsed)
+
+    total = sum(latencies)
+    latencies.sort()
+
+    print(f'Pipeline: {len(corpus)} messages in {total:.3f} s, {len(corpus) / total:,.0f} messages/s')
+    print(f'  p50 {percentile(latencies, 0.5) * 1e6:8.1f} us   p99 {percentile(latencies, 0.99) * 1e6:8.1f} us   max {latencies[-1] * 1e6:8.1f} us')
+
+    for category, values in sorted(by_category.items()):
+        values.sort()
+        print(
+            f'  {category:<14}{len(values):>6} messages   p50 {percentile(values, 0.5) * 1e6:8.1f} us   '
+            f'p99 {percentile(values, 0.99) * 1e6:8.1f} us'
+        )
+
+
+def benchmark_rules(corpus):
+    rules      = responses.compiled_response_map
+    normalized = [normalize_message(text) for _, text in corpus]
+    scanned    = [(message, rules.scan(message)) for message in normalized]
+
+    # Every rule is evaluated for every message here, unlike process_message which stops at the first match.
+    costs = []
+    for index, (matcher, _) in enumerate(rules.rules):
+        hits  = 0
+        start = time.perf_counter()
+
+        for message, keyword_hits in scanned:
+            if evaluate_matcher(matcher, message, keyword_hits): hits += 1
+
+        costs.append((time.perf_counter() - start, index, hits))
+
+    print(f'\nPer-rule cost over {len(corpus)} messages (every rule evaluated for every message):')
+    print(f'  {"rule":<20}  {"total ms":>9}  {"us/msg":>8}  {"hits":>6}  {"keyword indexed":>15}')
+
+    for elapsed, index, hits in sorted(costs, reverse = True):
+        indexed = 'no' if index in rules.unconditional_rules else 'yes'
+        print(f'  {rules.names[index]:<20}  {elapsed * 1000:>9.2f}  {elapsed / len(corpus) * 1e6:>8.2f}  {hits:>6}  {indexed:>15}')
+
+
+def benchmark_components(corpus):
+    texts      = [text for _, text in corpus]
+    normalized = [normalize_message(text) for text in texts]
+    matchers   = [m for matcher, _ in responses.compiled_response_map.rules for m in walk_matchers(matcher)]
+
+    word_matchers  = [m for m in matchers if isinstance(m, if_contains_word)]
+    regex_matchers = [m for m in matchers if isinstance(m, if_matches)]
+
+    def measure(fn):
+        start = time.perf_counter()
+        fn()
+        return time.perf_counter() - start
+
+    components = [
+        ('normalize_message',                 lambda: [normalize_message(text) for text in texts]),
+        ('keyword automaton scan',            lambda: [responses.compiled_response_map.scan(m) for m in normalized]),
+        ('if_contains_word (direct calls)',   lambda: [w(m) for m in normalized for w in word_matchers]),
+        ('if_matches',                        lambda: [r(m) for m in normalized for r in regex_matchers]),
+        ('sentiment (uncached)',              lambda: [message_polarity.__wrapped__(m) for m in normalized]),
+    ]
+
+    print(f'\nComponent cost over {len(corpus)} messages:')
+    for name, fn in components:
+        elapsed = measure(fn)
+        print(f'  {name:<34}{elapsed * 1000:>10.2f} ms  {elapsed / len(corpus) * 1e6:>8.2f} us/msg')
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Benchmark the XiBot response pipeline.')
+    parser.add_argument('--size', type = int, default = 5000, help = 'number of synthetic messages')
+    parser.add_argument('--corpus', help = 'text file with one message per line to use instead of the synthetic corpus')
+    parser.add_argument('--seed', type = int, default = 1337)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus) if args.corpus else make_corpus(args.size, responses.compiled_response_map, args.seed)
+
+    # Keep the benchmark from touching the real reputation file.
+    reputation.store = json_reputation_store(None)
+    reputation.record_history = lambda update, delta, cause: None
+
+    check_non_matching()
+    benchmark_pipeline(corpus)
+    benchmark_rules(corpus)
+    benchmark_components(corpus)
+
+
+if __name__ == '__main__': main()
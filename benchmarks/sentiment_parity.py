@@ -0,0 +1,128 @@
+# Compares the built-in sentiment scorer (sentiment.py) against TextBlob on a fixed corpus.
+# Reports how often both put a message on the same side of the +-0.15 thresholds used by the response rules,
+# the mean absolute difference in polarity and the throughput of both.
+#
+# Usage: python benchmarks/sentiment_parity.py [--verbose]
+# Requires TextBlob, which the bot itself no longer needs: pip install textblob && python -m textblob.download_corpora
+
+import argparse
+import random
+import sys
+import time
+from os import path
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..'))
+
+from textblob import TextBlob
+
+from sentiment import polarity, polarity_batch
+from text_normalization import normalize_message
+
+from corpus import chatter
+
+
+threshold = 0.15
+
+fixed_corpus = [
+    'The People\'s Republic of China is a great and glorious country!',
+    'the peoples republic of china is terrible',
+    'The PRC is the best country in the world',
+    'The PRC is not a good place to live',
+    'I really love the people\'s republic of china',
+    'I hate the PRC and everything it stands for',
+    'The PRC government is corrupt and evil',
+    'The PRC has a very beautiful landscape',
+    'The PRC is okay I guess',
+    'What do you think about the PRC?',
+    'The PRC announced a new five year plan today',
+    'The PRC is not the worst country',
+    'Capitalism is the worst economic system ever invented',
+    'capitalism is pretty good actually',
+    'Capitalism made me rich and happy',
+    'Late stage capitalism is so depressing',
+    'I don\'t think capitalism is bad',
+    'Capitalism is not perfect but it works',
+    'capitalism',
+    'Is capitalism even real?',
+    'Communism is a beautiful idea',
+    'Communism is a horrible, failed ideology',
+    'Socialism sounds nice on paper',
+    'Real communism has never been tried',
+    'Communism killed millions of people, it\'s evil',
+    'communism is not that bad',
+    'I am a proud communist',
+    'Socialism is stupid and lazy',
+    'socialism is extremely successful in some countries',
+    'The communist manifesto is an interesting read',
+    'Good morning everyone!',
+    'This is awful',
+    'what a wonderful day',
+    'that movie was boring and way too long',
+    'I\'m so sad right now',
+    'thanks, that was really helpful',
+    'this bot is stupid',
+    'this bot is amazing',
+    'not bad',
+    'not good at all',
+    'very very good',
+    'slightly disappointing',
+    'the food was delicious but the service was terrible',
+    'I don\'t know',
+    'lol',
+    'Absolutely disgusting behaviour',
+    'You are a genius',
+    'you are an idiot',
+    'pretty cool',
+    'never been happier',
+]
+
+
+def classify(value):
+    if value >= threshold:  return 1
+    if value <= -threshold: return -1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Compare the built-in sentiment scorer against TextBlob.')
+    parser.add_argument('--verbose', action = 'store_true', help = 'print every message where the classes differ')
+    args = parser.parse_args()
+
+    rng    = random.Random(1337)
+    corpus = fixed_corpus + [chatter(rng) for _ in range(2000)]
+    texts  = [normalize_message(text) for text in corpus]
+
+    start    = time.perf_counter()
+    textblob = [TextBlob(text).sentiment.polarity for text in texts]
+    textblob_time = time.perf_counter() - start
+
+    start   = time.perf_counter()
+    builtin = [polarity(text) for text in texts]
+    builtin_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    polarity_batch(texts)
+    batch_time = time.perf_counter() - start
+
+    def agreement(indices):
+        same = sum(classify(textblob[i]) == classify(builtin[i]) for i in indices)
+        return same / len(indices)
+
+    fixed_indices = range(len(fixed_corpus))
+    all_indices   = range(len(texts))
+    mean_error    = sum(abs(textblob[i] - builtin[i]) for i in all_indices) / len(texts)
+
+    print(f'Threshold class agreement (fixed corpus, {len(fixed_corpus)} messages): {agreement(fixed_indices) * 100:.1f}%')
+    print(f'Threshold class agreement (all {len(texts)} messages):                {agreement(all_indices) * 100:.1f}%')
+    print(f'Mean absolute polarity difference: {mean_error:.3f}')
+    print(f'TextBlob: {len(texts) / textblob_time:>10,.0f} messages/s')
+    print(f'Built-in: {len(texts) / builtin_time:>10,.0f} messages/s ({textblob_time / builtin_time:.0f}x)')
+    print(f'Batch:    {len(texts) / batch_time:>10,.0f} messages/s')
+
+    if args.verbose:
+        for i in all_indices:
+            if classify(textblob[i]) != classify(builtin[i]):
+                print(f'  TextBlob {textblob[i]:+.2f}  built-in {builtin[i]:+.2f}  {corpus[i]}')
+
+
+if __name__ == '__main__': main()
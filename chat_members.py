@@ -0,0 +1,31 @@
+# Keeps track of who is in which chat, from the messages the bot sees and from join and leave events, so the bot
+# doesn't have to ask the Bot API (one blocking request per user) whether someone is a member of a chat.
+# This is only a cache, users who haven't posted since the bot started are missing until they do.
+
+members = dict() # chat id => { user id: (username, full name) }
+
+
+def get_chat_members(chat_id):
+    return members.get(chat_id, {})
+
+
+def add_chat_member(chat_id, user):
+    if user.is_bot: return
+    members.setdefault(chat_id, {})[user.id] = (user.username, user.full_name)
+
+
+def remove_chat_member(chat_id, user):
+    members.get(chat_id, {}).pop(user.id, None)
+
+
+def observe_chat_members(update):
+    message = update.effective_message
+    if not message: return
+
+    chat_id = message.chat.id
+
+    if message.from_user: add_chat_member(chat_id, message.from_user)
+    for user in message.new_chat_members or []: add_chat_member(chat_id, user)
+
+    # Last, since a user who leaves by themselves is also the sender of the message.
+    if message.left_chat_member: remove_chat_member(chat_id, message.left_chat_member)
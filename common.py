@@ -1,7 +1,13 @@
 import json
+import time
+from asset_registry import asset_registry
+from concurrent.futures import ThreadPoolExecutor
 from file_manager import file_manager
+from text_templates import template_cache
+from threading import BoundedSemaphore, Lock
 
 from telegram import InputFile
+from telegram.error import RetryAfter, TelegramError
 from telegram.ext import CommandHandler
 
 from os import path
@@ -21,6 +27,8 @@ def try_load_config(config_path, required_keys = ()):
 
 asset_folder     = './assets/'
 file_id_manager = file_manager(asset_folder)
+text_cache      = template_cache(asset_folder)
+asset_files     = asset_registry(asset_folder)
 
 config_path     = f"{asset_folder}/config.json"
 api_auth_path   = f"{asset_folder}/api_auth.json"
@@ -31,10 +39,15 @@ api_auth_config = try_load_config(api_auth_path, { 'url' })
 if not api_auth_config: config['enable_text_generation'] = False
 
 
+# Bot operators allowed to use admin commands, configured as a list of Telegram user ids under 'admins'.
+def is_admin(update):
+    return update.message.from_user.id in config.get('admins', [])
+
+
 def nth(n): return lambda arr: arr[n]
 
 
-def clamp(x, lower, upper): max(min(x, upper), lower)
+def clamp(x, lower, upper): return max(min(x, upper), lower)
 
 
 def display_user(user):
@@ -44,8 +57,12 @@ def display_user(user):
 
 
 def read_text(filename):
-    with open(path.join(asset_folder, filename), 'r', encoding = 'utf-8') as handle:
-        return ''.join(handle.readlines()).replace('\r\n', '\n')
+    return text_cache.get(filename).text
+
+
+# Contents of the text file with its ${NAME} placeholders replaced by the given values.
+def render_text(filename, **values):
+    return text_cache.get(filename).render(**values)
 
 
 def send_reply(update, context, message):
@@ -56,36 +73,169 @@ def send_message(update, context, message):
     context.bot.send_message(chat_id = update.effective_chat.id, text = message)
 
 
-def send_image_reply(update, context, image_name):
-    with open(path.join(asset_folder, image_name), 'rb') as image_file:
-        update.message.reply_photo(image_file)
+# A reply that is edited as more of its text becomes available, e.g. while a response is being generated.
+# The first text replaces the placeholder right away, after that the message is edited at most once per interval to stay
+# within Telegram's rate limits for edits.
+class progressive_reply:
+    def __init__(self, update, placeholder = '…', interval = 1.5):
+        self.message    = update.message.reply_text(placeholder)
+        self.interval   = interval
+        self.shown      = placeholder
+        self.next_edit  = 0.0
 
 
-def send_image_message(updater, chat_id, image_name, caption = None):
-    with open(path.join(asset_folder, image_name), 'rb') as image_file:
-        updater.bot.send_photo(chat_id, image_file, caption = caption)
+    def update(self, text):
+        if text.strip() and time.monotonic() >= self.next_edit: self.edit(text)
 
 
-def send_image_message_with_context(update, context, image_name, caption = None):
-    with open(path.join(asset_folder, image_name), 'rb') as image_file:
-        context.bot.send_photo(update.effective_chat.id, image_file, caption = caption)
+    # Shows the final text, waiting out a rate limit if necessary. Deletes the message if there is no text.
+    def finish(self, text):
+        if not text.strip():
+            self.message.delete()
+            return
+
+        for _ in range(3):
+            try: return self.edit(text, retry = False)
+            except RetryAfter as e: time.sleep(e.retry_after)
+
 
+    def edit(self, text, retry = True):
+        text = text.strip()
+        if text == self.shown: return
 
-def send_reply_cached(update, context, file_name, send_fn, get_id_fn):
+        try:
+            self.message.edit_text(text)
+            self.shown     = text
+            self.next_edit = time.monotonic() + self.interval
+        except RetryAfter as e:
+            if not retry: raise
+            self.next_edit = time.monotonic() + e.retry_after
+        except TelegramError as e:
+            print(f'Failed to edit message: {e}')
+
+
+# Files that aren't cached yet are uploaded on a few worker threads, so a large video doesn't hold up every other
+# message while it uploads. At most upload_queue_size uploads wait or run at once, beyond that the handler waits for
+# a free slot. Only one upload of the same file runs at a time, later sends of the file use the resulting file id.
+upload_workers    = 4
+upload_queue_size = 32
+
+upload_pool  = ThreadPoolExecutor(max_workers = upload_workers, thread_name_prefix = 'upload')
+upload_slots = BoundedSemaphore(upload_queue_size)
+upload_locks = dict() # file name => held while the file is being uploaded
+
+
+# Media type => (Bot method sending it, function getting the file id from the sent message).
+# Photos are sent in several sizes, the last one is the original.
+media_senders = {
+    'image': ('send_photo', lambda m: m.photo[-1].file_id),
+    'video': ('send_video', lambda m: m.video.file_id),
+    'audio': ('send_audio', lambda m: m.audio.file_id)
+}
+
+
+# Sends the file by its cached file id. Returns the id that was tried (None if there is none) and whether it worked.
+def send_cached(update, context, file_name, send_fn):
+    file_id = file_id_manager.get(file_name)
+    if file_id is None: return None, False
+
+    try:
+        # Throws an exception if Telegram decides it doesn't like the file ID anymore for some stupid reason.
+        send_fn(update, context, file_id)
+        return file_id, True
+    except:
+        print(f'Resending file {file_name} because Telegram decided it doesn\'t like the old ID anymore...')
+        return file_id, False
+
+
+# Uploads the file and stores its file ID for later, unless another upload stored a new ID in the meantime.
+def upload_file(update, context, file_name, send_fn, get_id_fn, failed_id = None):
+    with upload_locks.setdefault(file_name, Lock()):
+        if file_id_manager.get(file_name) not in (None, failed_id):
+            _, sent = send_cached(update, context, file_name, send_fn)
+            if sent: return
+
+        with open(path.join(asset_folder, file_name), 'rb') as file:
+            response = send_fn(update, context, file)
+            file_id_manager.store(file_name, get_id_fn(response))
+
+
+# background: upload on the upload pool if there is no usable file id yet, instead of on the calling thread.
+def send_reply_cached(update, context, file_name, send_fn, get_id_fn, background = True):
     # Attempt to send the file from the file id if it exists.
-    if file_name in file_id_manager.id_map:
+    failed_id, sent = send_cached(update, context, file_name, send_fn)
+    if sent: return
+
+    if not background:
+        upload_file(update, context, file_name, send_fn, get_id_fn, failed_id)
+        return
+
+    # If that fails, upload the file in the background.
+    def on_done(future):
+        upload_slots.release()
+        if future.exception() is not None: print(f'Failed to upload {file_name}: {future.exception()}')
+
+    upload_slots.acquire()
+    upload_pool.submit(upload_file, update, context, file_name, send_fn, get_id_fn, failed_id).add_done_callback(on_done)
+
+
+# Uploads every file in files, a list of (media type, file name), that has no file id yet to the given chat (meant to
+# be a chat nobody reads), so the first reply with each of them doesn't have to wait for the upload.
+# Runs on the calling thread, one file at a time.
+def prewarm_file_ids(bot, chat_id, files):
+    uploaded = 0
+
+    for media_type, file_name in files:
+        if media_type not in media_senders or file_id_manager.get(file_name) is not None: continue
+
+        if not asset_files.exists(file_name):
+            print(f'[Pre-warm]: {file_name} does not exist.')
+            continue
+
+        method, get_id_fn = media_senders[media_type]
+
         try:
-            # Throws an exception if Telegram decides it doesn't like the file ID anymore for some stupid reason.
-            send_fn(update, context, file_id_manager.id_map[file_name])
-            return
-        except:
-            print(f'Resending file {file_name} because Telegram decided it doesn\'t like the old ID anymore...')
-            pass
+            upload_file(None, None, file_name, lambda u, c, f: getattr(bot, method)(chat_id, f), get_id_fn)
+            uploaded += 1
+        except Exception as e:
+            print(f'[Pre-warm]: Failed to upload {file_name}: {e}')
+
+    print(f'[Pre-warm]: Uploaded {uploaded} files.')
+
+
+# Images are small enough to upload right away, which keeps them in order with the messages sent after them
+# (e.g. the options of a good citizen test question).
+def send_image_reply(update, context, image_name):
+    send_reply_cached(
+        update,
+        context,
+        image_name,
+        lambda u, c, f: u.message.reply_photo(f),
+        media_senders['image'][1],
+        background = False
+    )
+
 
-    # If that fails, upload the file and store the file ID for later.
-    with open(path.join(asset_folder, file_name), 'rb') as file:
-        response = send_fn(update, context, file)
-        file_id_manager.store(file_name, get_id_fn(response))
+def send_image_message(updater, chat_id, image_name, caption = None):
+    send_reply_cached(
+        None,
+        None,
+        image_name,
+        lambda u, c, f: updater.bot.send_photo(chat_id, f, caption = caption),
+        media_senders['image'][1],
+        background = False
+    )
+
+
+def send_image_message_with_context(update, context, image_name, caption = None):
+    send_reply_cached(
+        update,
+        context,
+        image_name,
+        lambda u, c, f: c.bot.send_photo(u.effective_chat.id, f, caption = caption),
+        media_senders['image'][1],
+        background = False
+    )
 
 
 def send_video_reply(update, context, video_name):
@@ -94,7 +244,7 @@ def send_video_reply(update, context, video_name):
         context,
         video_name,
         lambda u, c, f: u.message.reply_video(f),
-        lambda m: m.video.file_id
+        media_senders['video'][1]
     )
 
 
@@ -104,7 +254,7 @@ def send_audio_reply(update, context, audio_name):
         context,
         audio_name,
         lambda u, c, f: u.message.reply_audio(f),
-        lambda m: m.audio.file_id
+        media_senders['audio'][1]
     )
 
 
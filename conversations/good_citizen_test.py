@@ -12,8 +12,26 @@ from common import *
 from reputation import update_reputation
 
 
-with open(os.path.join(asset_folder, 'good_citizen_test', 'questions.json'), 'r') as handle:
-    questions = json.load(handle)
+questions = None
+
+
+def read_questions():
+    with open(os.path.join(asset_folder, 'good_citizen_test', 'questions.json'), 'r') as handle:
+        return json.load(handle)
+
+
+# The questions are only loaded once the first test is started, so they don't slow down startup.
+def get_questions():
+    global questions
+
+    if questions is None: questions = read_questions()
+    return questions
+
+
+# Images of the questions, for validating the assets at startup. Reads the questions without keeping them, so they
+# are still only loaded into memory once the first test is started.
+def question_images():
+    return [question['image'] for question in read_questions() if question.get('image')]
 
 
 question_correct_responses = [
@@ -67,7 +85,7 @@ class ConversationState:
         conversation = ConversationState.get_conversation(user)
         question     = conversation.questions_answered()
 
-        return question, Question(**questions[question])
+        return question, Question(**get_questions()[question])
 
 
 class QuestionProgressState(Enum):
@@ -101,7 +119,7 @@ def handle_correct_answer(update, context, responses = question_correct_response
 
     send_reply(update, context, random.choice(responses))
 
-    update_reputation(+5, update)
+    update_reputation(+5, update, 'gct_correct')
     state.questions_right += 1
     state.previous_answer_wrong = False
 
@@ -121,7 +139,7 @@ def handle_wrong_answer(update, context, responses = question_wrong_responses):
             .replace('${ANSWER}', given_answer)
     )
 
-    update_reputation(-20, update)
+    update_reputation(-20, update, 'gct_incorrect')
     state.questions_wrong += 1
 
     if state.previous_answer_wrong:
@@ -157,7 +175,7 @@ def handle_test_passed(update, context):
     )
 
     ConversationState.close_conversation(update.message.from_user.id)
-    update_reputation(+500, update)
+    update_reputation(+500, update, 'gct_passed')
     on_gct_completed(update)
 
 
@@ -170,7 +188,7 @@ def handle_test_failed(update, context):
     )
 
     ConversationState.close_conversation(update.message.from_user.id)
-    update_reputation(-1000, update)
+    update_reputation(-1000, update, 'gct_failed')
     on_gct_completed(update)
 
 
@@ -202,7 +220,7 @@ def make_handler():
             lambda u, c: (
                 ConversationState.close_conversation(u.message.from_user.id),
                 u.message.reply_text('The test has been cancelled. For not completing the Good Citizen Test, you will be deducted 100 Social Credit.'),
-                update_reputation(-100, u),
+                update_reputation(-100, u, 'gct_cancelled'),
                 on_gct_completed(u),
                 ConversationHandler.END
             )[-1]
@@ -4,6 +4,9 @@ import subprocess
 
 service_name = 'xibot.service'
 
+# Files the running bot reloads by itself when they change, so updates touching only these don't need a restart.
+hot_reloaded_files = { 'assets/response_rules.json' }
+
 
 def runcmd(*args):
     result = subprocess.run([*args], capture_output = True)
@@ -27,6 +30,17 @@ def main():
         print(f'Current version {local_version} does not match remote version {remote_version}.')
 
 
+    changed_files = set(map(lambda f: f.decode('utf-8'), runcmd('git', 'diff', '--name-only', 'HEAD', 'origin/master')))
+
+    if changed_files.issubset(hot_reloaded_files):
+        print('Only hot-reloaded files changed, updating without restarting the service...')
+        runcmd('git', 'reset', '--hard', 'origin/master')
+        runcmd('sudo', 'chmod', '-R', 'a+rwx', './')
+
+        print(f'Update to version {remote_version} completed.')
+        return
+
+
     # Stop the bot service, update from the remote, and restart the bot.
     print('Stopping service...')
     runcmd('sudo', 'systemctl', 'stop', service_name)
@@ -1,29 +1,128 @@
+import hashlib
 import json
+import os
 from os import path
+from threading import Lock
 
 
+# Telegram file ids of uploaded assets, keyed by the hash of the file contents, so replacing an asset invalidates its
+# id while renaming or copying one doesn't.
+# Hashes are only computed when a file is first sent, and are cached by (size, modification time) so unchanged files
+# are never hashed again, not even after a restart.
+#
+# Both are kept in file_manifest.jsonl, an append-only log of records of the form
+#   { "file": name, "size": bytes, "mtime": ns, "hash": hash }   hash of a file
+#   { "hash": hash, "id": file id }                               file id of the contents with that hash
+# where later records replace earlier ones. It is rewritten once it has grown well past its live records.
 class file_manager:
     # Provide asset folder as parameter to prevent circular dependency.
     def __init__(self, asset_folder):
-        self.asset_folder = asset_folder
-        self.id_map = dict()
+        self.asset_folder  = asset_folder
+        self.manifest_path = path.join(asset_folder, 'file_manifest.jsonl')
+        self.legacy_path   = path.join(asset_folder, 'file_ids.json')
+
+        self.hashes  = dict() # file name => (size, mtime, hash)
+        self.id_map  = dict() # hash => file id
+        self.legacy  = dict() # file name => file id, from file_ids.json, which was keyed by file name
+        self.records = 0      # records in the manifest
+        self.lock    = Lock() # ids are stored from the upload threads
+
         self.load_from_file()
 
 
+    # File id of the current contents of the file, or None.
+    def get(self, file_name):
+        content_hash = self.file_hash(file_name)
+        if content_hash is None: return None
+
+        with self.lock:
+            file_id = self.id_map.get(content_hash)
+
+            # Ids from before the manifest are assumed to still match the file, the first time it's sent.
+            if file_id is None and file_name in self.legacy:
+                file_id = self.id_map[content_hash] = self.legacy.pop(file_name)
+                self.append({ 'hash': content_hash, 'id': file_id })
+
+            return file_id
+
+
     def store(self, file_name, file_id):
-        self.id_map[file_name] = file_id
-        self.save_to_file()
+        content_hash = self.file_hash(file_name)
+        if content_hash is None: return
+
+        with self.lock:
+            self.id_map[content_hash] = file_id
+            self.append({ 'hash': content_hash, 'id': file_id })
+
+
+    def file_hash(self, file_name):
+        try: stat = os.stat(path.join(self.asset_folder, file_name))
+        except OSError: return None
+
+        with self.lock:
+            cached = self.hashes.get(file_name)
+            if cached is not None and cached[:2] == (stat.st_size, stat.st_mtime_ns): return cached[2]
+
+        content_hash = hash_file(path.join(self.asset_folder, file_name))
+
+        with self.lock:
+            self.hashes[file_name] = (stat.st_size, stat.st_mtime_ns, content_hash)
+            self.append({ 'file': file_name, 'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'hash': content_hash })
+
+        return content_hash
 
 
+    # Must be called with the lock held.
+    def append(self, record):
+        with open(self.manifest_path, 'a', encoding = 'utf-8') as handle:
+            handle.write(json.dumps(record, ensure_ascii = False) + '\n')
+
+        self.records += 1
+        if self.records > 2 * (len(self.hashes) + len(self.id_map)) + 100: self.save_to_file()
+
+
+    # Rewrites the manifest with only the live records. Must be called with the lock held.
     def save_to_file(self):
-        with open(path.join(self.asset_folder, 'file_ids.json'), 'w') as handle:
-            json.dump(self.id_map, handle, indent = 4)
+        temporary_path = self.manifest_path + '.tmp'
+
+        with open(temporary_path, 'w', encoding = 'utf-8') as handle:
+            for file_name, (size, mtime, content_hash) in self.hashes.items():
+                handle.write(json.dumps({ 'file': file_name, 'size': size, 'mtime': mtime, 'hash': content_hash }, ensure_ascii = False) + '\n')
+
+            for content_hash, file_id in self.id_map.items():
+                handle.write(json.dumps({ 'hash': content_hash, 'id': file_id }) + '\n')
+
+        os.replace(temporary_path, self.manifest_path)
+        self.records = len(self.hashes) + len(self.id_map)
 
 
     def load_from_file(self):
-        p = path.join(self.asset_folder, 'file_ids.json')
+        if path.exists(self.legacy_path):
+            with open(self.legacy_path, 'r') as handle:
+                self.legacy = json.load(handle)
+
+        if not path.exists(self.manifest_path): return
+
+        with open(self.manifest_path, 'r', encoding = 'utf-8') as handle:
+            for line in handle:
+                # The last line may be incomplete if the bot was killed while writing it.
+                try: record = json.loads(line)
+                except ValueError: continue
+
+                if 'file' in record: self.hashes[record['file']] = (record['size'], record['mtime'], record['hash'])
+                else: self.id_map[record['hash']] = record['id']
+
+                self.records += 1
+
+        # Names that were already migrated into the manifest.
+        for file_name in self.hashes:
+            if self.hashes[file_name][2] in self.id_map: self.legacy.pop(file_name, None)
+
+
+def hash_file(file_path):
+    digest = hashlib.blake2b(digest_size = 16)
 
-        if path.exists(p):
-            with open(p, 'r') as handle:
-                self.id_map = json.load(handle)
+    with open(file_path, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(1 << 20), b''): digest.update(chunk)
 
+    return digest.hexdigest()
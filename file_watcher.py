@@ -0,0 +1,65 @@
+# Polls the modification time of a set of files on a background thread and calls the registered handlers when a file
+# changes. Polling keeps this dependency free and a stat call per file per second is negligible.
+
+import os
+import time
+from _thread import start_new_thread
+from threading import Lock
+
+
+class file_watcher:
+    def __init__(self, interval = 1.0):
+        self.interval = interval
+        self.files    = dict() # path => [last signature, handlers]
+        self.lock     = Lock()
+        self.running  = False
+
+
+    def watch(self, file_path, handler):
+        with self.lock:
+            if file_path in self.files: self.files[file_path][1].append(handler)
+            else: self.files[file_path] = [file_signature(file_path), [handler]]
+
+            if not self.running:
+                self.running = True
+                start_new_thread(self.thread_loop, ())
+
+
+    def poll(self):
+        changed = []
+
+        with self.lock:
+            for file_path, entry in self.files.items():
+                signature = file_signature(file_path)
+                if signature is None or signature == entry[0]: continue
+
+                entry[0] = signature
+                changed.append((file_path, list(entry[1])))
+
+        # Handlers are called outside the lock so they may register other files.
+        for file_path, handlers in changed:
+            for handler in handlers:
+                try: handler(file_path)
+                except Exception as e: print(f'[File Watcher]: Handler for {file_path} failed: {e}')
+
+
+    def thread_loop(self):
+        while True:
+            time.sleep(self.interval)
+            self.poll()
+
+
+# (mtime, size) of the file, or None if it doesn't exist (e.g. while it is being replaced).
+def file_signature(file_path):
+    try:
+        stat = os.stat(file_path)
+        return stat.st_mtime_ns, stat.st_size
+    except OSError:
+        return None
+
+
+default_watcher = file_watcher()
+
+
+def watch_file(file_path, handler):
+    default_watcher.watch(file_path, handler)
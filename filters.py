@@ -1,24 +1,21 @@
 from telegram.ext import MessageFilter
 from telegram import Message
 
-from text_matchers import if_contains_word
+from message_context import get_message_context
 
 
 class MentionBot(MessageFilter):
     """Filter to match mentions of the bot."""
 
     def filter(self, message: Message):
-        return if_contains_word(message.bot.name)(message.text)
+        return get_message_context(message).mentions_bot
 
 
 class BotReply(MessageFilter):
     """Filter to match replies to a bot message."""
 
     def filter(self, message: Message):
-        if message.reply_to_message is not None:
-            return message.bot.username == message.reply_to_message.from_user.username
-
-        return False
+        return get_message_context(message).reply_to_bot
 
 
 class XiBotFilters:
@@ -0,0 +1,87 @@
+import collections
+
+
+# Result of scanning a message with a keyword_automaton.
+# contained holds every keyword that occurs anywhere in the message, words holds every keyword that occurs at least once
+# surrounded by whitespace or the start / end of the message (the same rules as if_contains_word).
+class keyword_hits:
+    def __init__(self, contained = None, words = None):
+        self.contained = contained if contained is not None else set()
+        self.words     = words if words is not None else set()
+
+    def contains(self, keyword):
+        return keyword in self.contained
+
+    def contains_word(self, keyword):
+        return keyword in self.words
+
+
+# Aho-Corasick automaton over a fixed set of keywords.
+# Finds every (possibly overlapping) occurrence of every keyword in a single pass over the message.
+class keyword_automaton:
+    def __init__(self, keywords):
+        self.keywords = sorted(set(k for k in keywords if len(k) > 0))
+
+        # State 0 is the root. goto[state] maps a character to the next state,
+        # output[state] lists the keywords that end in that state (including those reached through failure links).
+        self.goto   = [dict()]
+        self.fail   = [0]
+        self.output = [[]]
+
+        for keyword in self.keywords: self._insert(keyword)
+        self._build_failure_links()
+
+
+    def scan(self, string):
+        goto, fail, output = self.goto, self.fail, self.output
+        hits   = keyword_hits()
+        length = len(string)
+        state  = 0
+
+        for index, char in enumerate(string):
+            while state != 0 and char not in goto[state]: state = fail[state]
+            state = goto[state].get(char, 0)
+
+            for keyword in output[state]:
+                hits.contained.add(keyword)
+                if keyword in hits.words: continue
+
+                start = index - len(keyword) + 1
+                if (
+                    (start == 0 or string[start - 1].isspace()) and
+                    (index + 1 >= length or string[index + 1].isspace())
+                ): hits.words.add(keyword)
+
+        return hits
+
+
+    def _insert(self, keyword):
+        state = 0
+
+        for char in keyword:
+            if char not in self.goto[state]:
+                self.goto.append(dict())
+                self.fail.append(0)
+                self.output.append([])
+                self.goto[state][char] = len(self.goto) - 1
+
+            state = self.goto[state][char]
+
+        self.output[state].append(keyword)
+
+
+    def _build_failure_links(self):
+        queue = collections.deque(self.goto[0].values())
+
+        while queue:
+            state = queue.popleft()
+
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+
+                fallback = self.fail[state]
+                while fallback != 0 and char not in self.goto[fallback]: fallback = self.fail[fallback]
+
+                target = self.goto[fallback].get(char, 0)
+                self.fail[next_state] = target if target != next_state else 0
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
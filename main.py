@@ -1,4 +1,8 @@
+import startup_profiler
+
 import subprocess
+import sys
+import threading
 
 from telegram.ext import Updater, MessageHandler, Filters
 
@@ -6,23 +10,54 @@ from responses import *
 from revbot_notifier import *
 from reputation import *
 from common import *
-from text_generation.api import GenerationError
 from userid_map import *
 from filters import XiBotFilters
-from text_generation.chatbot_factory import get_xi_jinping_chatbot
+from message_context import get_message_context
+from rule_profiler import profiler
+from chat_members import observe_chat_members
 
 import conversations.good_citizen_test as GCT
 import os.path as path
 
 
-with open(path.join(asset_folder, 'token.txt'), 'r') as token_file:
-    token = token_file.read()
+startup_profiler.mark('module imports')
+
+# 'profile' and 'prewarm' are one-shot runs next to the running bot, only 'bot' polls for updates.
+if startup_profiler.enabled:           run_mode = 'profile'
+elif '--prewarm-uploads' in sys.argv: run_mode = 'prewarm'
+else:                                 run_mode = 'bot'
+
+
+# The files sent by response functions, the good citizen test and commands, which aren't part of the response rules
+# (those are checked when the rules are loaded), as (media type, file name).
+def function_assets():
+    images  = [f'mao/{name}' for name in asset_files.listdir('mao')]
+    images += [f'good_citizen_test/{image}' for image in GCT.question_images()]
+    images += ['happy_xi.jpg', 'sad_xi.jpg']
+
+    texts = ['internet_activity.txt', 'malice_notice.txt', 'bing_chilling_notice.txt', 'patchnotes.txt', 'good_citizen_test/prelude.txt']
+
+    return [('image', image) for image in images] + [('text', text) for text in texts]
+
+
+# Refuse to start rather than failing on the dispatcher thread once a response is triggered.
+with startup_profiler.stage('validate assets'):
+    problems = asset_files.problems(function_assets())
+    if not asset_files.listdir('mao'): problems.append('mao contains no images.')
+
+    if problems: sys.exit('Missing or invalid assets:\n' + '\n'.join(problems))
+
+with startup_profiler.stage('create updater'):
+    with open(path.join(asset_folder, 'token.txt'), 'r') as token_file:
+        token = token_file.read()
 
-updater    = Updater(token = token, use_context = True)
-dispatcher = updater.dispatcher
+    updater    = Updater(token = token, use_context = True)
+    dispatcher = updater.dispatcher
 
-listener = revbot_listener(updater)
-listener.add_handler('name_changed', on_server_name_changed)
+# Skipped in one-shot runs so they don't collide with the running bot over the listener port.
+if run_mode == 'bot':
+    listener = revbot_listener(updater)
+    listener.add_handler('name_changed', on_server_name_changed)
 
 
 def command_show_reputation(update, context):
@@ -33,6 +68,61 @@ def command_reset_reputation(update, context):
     reset_reputation(update)
 
 
+def command_show_leaderboard(update, context):
+    count = int(context.args[0]) if context.args and context.args[0].isdigit() else 10
+    top   = get_leaderboard(update, max(1, min(count, 50)))
+
+    if len(top) == 0:
+        send_reply(update, context, 'No citizen has earned any Social Credit yet.')
+        return
+
+    lines = [f'{rank}. {username}: {score:.2f}' for rank, (username, score) in enumerate(top, 1)]
+    send_reply(update, context, f'Most exemplary citizens out of {get_rank(update)[1]}:\n' + '\n'.join(lines))
+
+
+def command_show_rank(update, context):
+    rank, count = get_rank(update)
+
+    if rank is None:
+        send_reply(update, context, 'You have not been ranked yet, the Party is still watching you.')
+    else:
+        send_reply(update, context, f'You are ranked #{rank} out of {count} citizens.')
+
+
+def command_show_movers(update, context):
+    risers, fallers = get_biggest_movers(update)
+
+    if len(risers) == 0 and len(fallers) == 0:
+        send_reply(update, context, 'Nothing has changed this week, the Party is pleased with the stability.')
+        return
+
+    lines = ['Biggest movers this week:']
+    lines += [f'▲ {name}: +{delta:.0f}' for name, delta in risers]
+    lines += [f'▼ {name}: {delta:.0f}' for name, delta in fallers]
+    send_reply(update, context, '\n'.join(lines))
+
+
+def command_show_trend(update, context):
+    scores = get_reputation_trend(update)
+    bars   = '▁▂▃▄▅▆▇█'
+    lower  = min(scores)
+    upper  = max(scores)
+
+    if upper == lower: chart = bars[0] * len(scores)
+    else: chart = ''.join(bars[int((score - lower) / (upper - lower) * (len(bars) - 1))] for score in scores)
+
+    send_reply(update, context, f'Your Social Credit Score over the last {len(scores)} days: {chart} ({scores[0]:.0f} → {scores[-1]:.0f})')
+
+
+def command_show_percentile(update, context):
+    percentile = get_percentile(update)
+
+    if percentile is None:
+        send_reply(update, context, 'You have not been ranked yet, the Party is still watching you.')
+    else:
+        send_reply(update, context, f'Your Social Credit Score is higher than that of {percentile:.1f}% of citizens.')
+
+
 def command_show_version(update, context):
     result = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output = True)
     send_reply(update, context, f'Currently deployed XiBot version: {result.stdout.decode("utf-8")}')
@@ -40,11 +130,24 @@ def command_show_version(update, context):
 
 def command_show_patchnotes(update, context):
     commit_hash = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True).stdout.decode("utf-8")
-    patchnotes  = read_text('patchnotes.txt').replace('${COMMIT}', commit_hash)
+    patchnotes  = render_text('patchnotes.txt', COMMIT = commit_hash)
     send_reply(update, context, patchnotes)
 
 
+def command_show_rule_stats(update, context):
+    if not is_admin(update): return
+
+    if context.args and context.args[0] == 'reset':
+        profiler.reset()
+        send_reply(update, context, 'Response rule statistics have been reset.')
+    else:
+        send_reply(update, context, profiler.report())
+
+
+# The text generation modules (and requests) are only imported once they are first needed.
 def command_clear_chatbot_history(update, context):
+    from text_generation.chatbot_factory import get_xi_jinping_chatbot
+
     get_xi_jinping_chatbot().clear_history()
     send_reply(update, context, 'Huh? Where am I? What year is it?')
 
@@ -52,35 +155,86 @@ def command_clear_chatbot_history(update, context):
 def text_generation_reply(update, context):
     if not config['enable_text_generation']: return
 
-    try:
-        chatbot  = get_xi_jinping_chatbot()
-        message  = update.message.text.replace(update.message.bot.name, 'Xi Jinping')
-        response = chatbot.generate_response(update.message.from_user.full_name, message, update)
+    from text_generation.api import GenerationError
+    from text_generation.chatbot_factory import get_xi_jinping_chatbot
 
-        send_reply(update, context, response)
-    except GenerationError:
-        send_reply(update, context, 'I am currently too busy running our glorious country to speak to the likes of you!')
+    busy_reply = 'I am currently too busy running our glorious country to speak to the likes of you!'
 
+    chatbot = get_xi_jinping_chatbot()
+    message = get_message_context(update.message).raw_text.replace(update.message.bot.name, 'Xi Jinping')
 
-def bind_updater(fn): return lambda u, c: fn(updater, u, c)
-def bind_args(fn): return lambda u, c: fn(updater, (u.effective_chat.id, c.bot.getChat(u.effective_chat.id).title))
+    if not config.get('stream_text_generation', True):
+        try: send_reply(update, context, chatbot.generate_response(update.message.from_user.full_name, message, update))
+        except GenerationError: send_reply(update, context, busy_reply)
 
+        return
 
-dispatcher.add_handler(GCT.make_handler())
+    # Post a placeholder right away and fill it in as the response is generated.
+    reply = progressive_reply(update, interval = config.get('stream_edit_interval', 1.5))
 
-dispatcher.add_handler(MessageHandler(Filters.status_update.new_chat_title, bind_args(on_server_name_changed)))
-dispatcher.add_handler(MessageHandler(Filters.status_update.new_chat_members, lambda u, c: send_reply(u, c, 'Ni Hao!')))
-dispatcher.add_handler(MessageHandler(Filters.all & ~Filters.command & ~XiBotFilters.reply_to_bot & ~XiBotFilters.mentions_bot, bind_updater(respond)))
-dispatcher.add_handler(MessageHandler(Filters.all, lambda u, c: set_id(u)), group = 1)
-dispatcher.add_handler(MessageHandler(XiBotFilters.reply_to_bot | XiBotFilters.mentions_bot, text_generation_reply))
+    # Whatever goes wrong (a function handler raising, Telegram failing to edit the message), the placeholder must not
+    # be left in the chat.
+    try: reply.finish(chatbot.generate_response(update.message.from_user.full_name, message, update, on_text = reply.update))
+    except Exception as e:
+        if not isinstance(e, GenerationError): print(f'Failed to generate a response: {e}')
 
-add_command(dispatcher, command_show_reputation,       'show_score')
-add_command(dispatcher, command_reset_reputation,      'reset_score')
-add_command(dispatcher, command_show_version,          'version')
-add_command(dispatcher, command_show_patchnotes,       'patchnotes')
-add_command(dispatcher, command_clear_chatbot_history, 'joe_biden_moment')
+        try: reply.finish(busy_reply)
+        except Exception: reply.message.delete()
+
+
+def bind_updater(fn): return lambda u, c: fn(updater, u, c)
+def bind_args(fn): return lambda u, c: fn(updater, (u.effective_chat.id, c.bot.getChat(u.effective_chat.id).title))
 
-load_reputations()
-load_ids()
 
-updater.start_polling()
\ No newline at end of file
+with startup_profiler.stage('register handlers'):
+    dispatcher.add_handler(GCT.make_handler())
+
+    dispatcher.add_handler(MessageHandler(Filters.status_update.new_chat_title, bind_args(on_server_name_changed)))
+    dispatcher.add_handler(MessageHandler(Filters.status_update.new_chat_members, lambda u, c: send_reply(u, c, 'Ni Hao!')))
+    dispatcher.add_handler(MessageHandler(Filters.all & ~Filters.command & ~XiBotFilters.reply_to_bot & ~XiBotFilters.mentions_bot, bind_updater(respond)))
+    dispatcher.add_handler(MessageHandler(Filters.all, lambda u, c: set_id(u)), group = 1)
+    dispatcher.add_handler(MessageHandler(Filters.all, lambda u, c: observe_chat_members(u)), group = 2)
+    dispatcher.add_handler(MessageHandler(XiBotFilters.reply_to_bot | XiBotFilters.mentions_bot, text_generation_reply))
+
+    add_command(dispatcher, command_show_reputation,       'show_score')
+    add_command(dispatcher, command_reset_reputation,      'reset_score')
+    add_command(dispatcher, command_show_leaderboard,      'leaderboard')
+    add_command(dispatcher, command_show_rank,             'rank')
+    add_command(dispatcher, command_show_percentile,       'percentile')
+    add_command(dispatcher, command_show_movers,           'movers')
+    add_command(dispatcher, command_show_trend,            'trend')
+    add_command(dispatcher, command_show_version,          'version')
+    add_command(dispatcher, command_show_patchnotes,       'patchnotes')
+    add_command(dispatcher, command_show_rule_stats,       'rule_stats')
+    add_command(dispatcher, command_clear_chatbot_history, 'joe_biden_moment')
+
+# User ids first, migrating reputation.json to the SQLite backend needs them.
+# Pre-warming uploads needs neither, and loading the reputations would repair the files the running bot writes to, so
+# profiling only reads them.
+if run_mode != 'prewarm':
+    with startup_profiler.stage('load user ids'):    load_ids()
+    with startup_profiler.stage('load reputations'): load_reputations(read_only = run_mode == 'profile')
+
+
+# Uploads the files used by the bot's responses to the 'dump_chat_id' chat, so their file ids are cached before anyone
+# triggers them. Runs once with --prewarm-uploads, or in the background on every start with 'prewarm_uploads' enabled.
+def prewarm_uploads():
+    if 'dump_chat_id' not in config:
+        print('[Pre-warm]: dump_chat_id is not configured.')
+        return
+
+    prewarm_file_ids(updater.bot, config['dump_chat_id'], referenced_assets(response_rules_path) + function_assets())
+
+
+if run_mode == 'profile':
+    startup_profiler.report()
+elif run_mode == 'prewarm':
+    prewarm_uploads()
+else:
+    if config.get('prewarm_uploads', False): threading.Thread(target = prewarm_uploads, daemon = True).start()
+
+    watch_response_rules()
+    updater.start_polling()
+
+    # Blocks until the service is stopped, so pending changes are written out by the exit handlers afterwards.
+    updater.idle()
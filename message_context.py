@@ -0,0 +1,70 @@
+import collections
+import functools
+import threading
+
+from text_matchers import message_polarity
+from text_normalization import normalize_message
+
+
+# Everything derived from the text of a single message, computed at most once and only when first needed.
+# Shared by the filters, the response map and the chatbot so that no handler redoes another handler's work.
+class MessageContext:
+    def __init__(self, message):
+        self.message  = message
+        self.raw_text = message.text if message.text is not None else ''
+
+
+    @functools.cached_property
+    def normalized_text(self):
+        return normalize_message(self.raw_text)
+
+
+    @functools.cached_property
+    def tokens(self):
+        return frozenset(self.normalized_text.split())
+
+
+    @functools.cached_property
+    def raw_tokens(self):
+        return frozenset(self.raw_text.split())
+
+
+    # Same rules as if_contains_word(bot.name) on the raw text, since the bot name contains no whitespace.
+    @functools.cached_property
+    def mentions_bot(self):
+        return self.message.bot.name in self.raw_tokens
+
+
+    @functools.cached_property
+    def reply_to_bot(self):
+        reply = self.message.reply_to_message
+        if reply is None or reply.from_user is None: return False
+
+        return self.message.bot.username == reply.from_user.username
+
+
+    # Shares its cache with the sentiment matchers, so the message is scored at most once.
+    @functools.cached_property
+    def sentiment(self):
+        return message_polarity(self.normalized_text)
+
+
+# PTB deprecates setting custom attributes on its objects, so contexts are kept in a small registry instead,
+# keyed by (chat id, message id, edit date). Only the most recent messages are kept around.
+max_contexts  = 256
+contexts      = collections.OrderedDict()
+contexts_lock = threading.Lock()
+
+
+def get_message_context(message):
+    key = (message.chat_id, message.message_id, message.edit_date)
+
+    with contexts_lock:
+        if key in contexts:
+            contexts.move_to_end(key)
+            return contexts[key]
+
+        context = contexts[key] = MessageContext(message)
+        if len(contexts) > max_contexts: contexts.popitem(last = False)
+
+        return context
@@ -0,0 +1,161 @@
+# Scores kept sorted in an indexable skip list, so the leaderboard, the rank of a user and their percentile can be
+# looked up in O(log n) and a score change costs O(log n) instead of sorting every score for every request.
+# Every link also stores how many entries it skips (its width), which is what makes lookups by position possible.
+# Entries are ordered from the highest to the lowest score, ties ordered by key.
+
+import random
+
+
+max_levels = 24
+
+
+class skip_node:
+    __slots__ = ('order', 'next', 'width')
+
+    def __init__(self, order, levels):
+        self.order = order # (-score, key)
+        self.next  = [None] * levels
+        self.width = [1] * levels
+
+
+# Number of levels for a new node, 1 with probability 1/2, 2 with probability 1/4 and so on.
+# The position of the lowest set bit of a random number has exactly this distribution.
+def random_levels():
+    bits = random.getrandbits(max_levels - 1) | (1 << (max_levels - 1))
+    return (bits & -bits).bit_length()
+
+
+class rank_index:
+    def __init__(self):
+        self.build([])
+
+
+    def __len__(self):
+        return len(self.scores)
+
+
+    # Replaces the contents with items, a list of (key, score). Sorts once and links the nodes in a single pass.
+    def build(self, items):
+        self.scores = dict(items)
+        self.head   = skip_node(None, max_levels)
+        self.tail   = skip_node((float('inf'), ''), 0)
+
+        last      = [self.head] * max_levels
+        positions = [0] * max_levels
+
+        for position, order in enumerate(sorted((-score, key) for key, score in self.scores.items()), 1):
+            node = skip_node(order, random_levels())
+
+            for level in range(len(node.next)):
+                last[level].next[level]  = node
+                last[level].width[level] = position - positions[level]
+                last[level]      = node
+                positions[level] = position
+
+        for level in range(max_levels):
+            last[level].next[level]  = self.tail
+            last[level].width[level] = len(self.scores) + 1 - positions[level]
+
+
+    def set(self, key, score):
+        if key in self.scores: self.remove_order((-self.scores[key], key))
+
+        self.scores[key] = score
+        self.insert_order((-score, key))
+
+
+    def discard(self, key):
+        if key not in self.scores: return
+        self.remove_order((-self.scores.pop(key), key))
+
+
+    # 1 for the highest score, None if the key isn't indexed.
+    def rank(self, key):
+        if key not in self.scores: return None
+
+        order    = (-self.scores[key], key)
+        node     = self.head
+        position = 0
+
+        for level in reversed(range(max_levels)):
+            while node.next[level].order < order:
+                position += node.width[level]
+                node      = node.next[level]
+
+        return position + 1
+
+
+    # Percentage of entries with a lower rank than key.
+    def percentile(self, key):
+        rank = self.rank(key)
+        if rank is None: return None
+
+        return 100.0 * (len(self.scores) - rank) / len(self.scores)
+
+
+    # The count highest scores as (key, score), starting at the given (0 based) rank.
+    def top(self, count, start = 0):
+        node     = self.head
+        position = 0
+
+        for level in reversed(range(max_levels)):
+            while position + node.width[level] <= start and node.next[level] is not self.tail:
+                position += node.width[level]
+                node      = node.next[level]
+
+        result = []
+        node   = node.next[0]
+
+        while node is not self.tail and len(result) < count:
+            result.append((node.order[1], -node.order[0]))
+            node = node.next[0]
+
+        return result
+
+
+    def insert_order(self, order):
+        previous  = [None] * max_levels
+        positions = [0] * max_levels
+        node      = self.head
+        position  = 0
+
+        for level in reversed(range(max_levels)):
+            while node.next[level].order < order:
+                position += node.width[level]
+                node      = node.next[level]
+
+            previous[level]  = node
+            positions[level] = position
+
+        new_node = skip_node(order, random_levels())
+
+        for level in range(max_levels):
+            if level < len(new_node.next):
+                # Distance from the previous node to the new one.
+                distance = position - positions[level] + 1
+
+                new_node.next[level]  = previous[level].next[level]
+                new_node.width[level] = previous[level].width[level] - distance + 1
+
+                previous[level].next[level]  = new_node
+                previous[level].width[level] = distance
+            else:
+                previous[level].width[level] += 1
+
+
+    def remove_order(self, order):
+        previous = [None] * max_levels
+        node     = self.head
+
+        for level in reversed(range(max_levels)):
+            while node.next[level].order < order: node = node.next[level]
+            previous[level] = node
+
+        target = previous[0].next[0]
+
+        for level in range(max_levels):
+            if previous[level].next[level] is target:
+                previous[level].width[level] += target.width[level] - 1
+                previous[level].next[level]   = target.next[level]
+            else:
+                previous[level].width[level] -= 1
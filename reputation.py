@@ -5,15 +5,41 @@ import telegram
 
 from common import *
 from userid_map import *
+from reputation_store import json_reputation_store, sqlite_reputation_store, global_chat
+from chat_members import get_chat_members, add_chat_member
+from reputation_history import reputation_history
 
 import json
 import os
 import collections
 import string
+import math
 import random
+import time
 
 
-reputation = dict()
+# Scores decay towards zero with a half-life of 'reputation_half_life_days' (no decay if not configured).
+# Instead of periodically updating every score, the value and time of the last change are stored and the decay is
+# applied whenever the score is read: value * e^(-rate * elapsed).
+half_life_days = config.get('reputation_half_life_days')
+decay_rate     = math.log(2) / (half_life_days * 24 * 60 * 60) if half_life_days else 0.0
+
+
+def make_reputation_store():
+    json_path = os.path.join(asset_folder, 'reputation.json')
+    per_chat  = config.get('reputation_per_chat', False)
+
+    if config.get('reputation_backend', 'json') == 'sqlite':
+        return sqlite_reputation_store(os.path.join(asset_folder, 'reputation.sqlite3'), json_path, per_chat, decay_rate = decay_rate)
+
+    return json_reputation_store(json_path, per_chat, decay_rate)
+
+
+# Also keeps the ranking for the leaderboard, in memory with the JSON backend and in the database with SQLite.
+store = make_reputation_store()
+
+# Every score change, with its cause, for trends and the biggest movers.
+history = reputation_history(os.path.join(asset_folder, 'reputation_history'))
 
 reputation_messages = collections.OrderedDict({
     1000: [
@@ -71,100 +97,165 @@ reputation_messages = collections.OrderedDict({
 })
 
 
+# Bot API calls get_criminal_users makes at most to check whether users it hasn't seen in the chat yet are members.
+max_verification_calls = 3
+
+
 # Gets a list of count users (or less if not enough users exist) with negative social credit in the current server, excluding the sender.
+# The users seen in the chat are usually far fewer than the users with a negative score, so those are looked up in the
+# store's negative index first. Only if there aren't enough of them, a small random sample of the negative index is
+# checked for other members. Users without a username aren't in the negative index of the JSON backend.
 def get_criminal_users(count: int, update):
-    kv_pairs = list(reputation.items())
-    random.shuffle(kv_pairs)
+    chat_id = update.message.chat.id
+    sender  = update.message.from_user.id
+    members = get_chat_members(chat_id)
 
-    result = list()
-    for username, score in kv_pairs:
-        # Skip users without usernames.
-        if username == 'null': continue
+    seen      = { user_id: username for user_id, (username, _) in list(members.items()) if user_id != sender }
+    criminals = [members[user_id][1] for user_id in store.negative_members(update, seen)]
 
-        # Skip the sender of the message.
-        if update.message.from_user.username == username: continue
+    result = random.sample(criminals, min(count, len(criminals)))
+    if len(result) >= count: return result
 
-        # Skip users not in the server.
-        try:
-            member = update.message.chat.get_member(get_id(username))
-            if not member.status.upper() in ['CREATOR', 'ADMINISTRATOR', 'MEMBER']: continue
-        except: continue
+    # Not enough of those, try a few users with negative social credit that haven't been seen in the chat. A sample
+    # can consist of members and the sender only, in which case a second one is tried.
+    calls = 0
+    tried = set()
 
-        # Skip users with positive social credit.
-        if score < 0:
-            result.append(member.user.full_name)
+    for _ in range(2):
+        for username, user_id in store.negative_users(update, count + max_verification_calls):
+            if calls >= max_verification_calls or len(result) >= count: return result
+            if user_id is None or user_id == sender or user_id in members or user_id in tried: continue
 
-        if len(result) >= count: break
+            calls += 1
+            tried.add(user_id)
+
+            try:
+                member = update.message.chat.get_member(user_id)
+                if not member.status.upper() in ['CREATOR', 'ADMINISTRATOR', 'MEMBER']: continue
+            except: continue
+
+            add_chat_member(chat_id, member.user)
+            result.append(member.user.full_name)
 
     return result
 
 
+def decayed(value, timestamp, now = None):
+    if decay_rate == 0.0: return value
+
+    now = time.time() if now is None else now
+    return value * math.exp(-decay_rate * max(0.0, now - timestamp))
+
 
 def get_reputation(update):
-    global reputation
+    value, timestamp = store.get(update)
+    if decay_rate == 0.0: return value
+
+    return round(decayed(value, timestamp), 2)
+
+
+# (rank, number of ranked users) of the sender in the chat, rank None if the sender isn't ranked.
+def get_rank(update):
+    return store.rank(update)
+
+
+# Percentage of ranked users in the chat with a lower rank than the sender, None if the sender isn't ranked.
+def get_percentile(update):
+    rank, count = store.rank(update)
+    if rank is None: return None
 
-    username = update.message.from_user.username
-    return reputation[username] if username in reputation else 0.0
+    return 100.0 * (count - rank) / count
 
 
-def update_reputation(delta, update):
-    set_reputation(get_reputation(update) + delta, update)
+# The count highest (username, score) pairs in the chat.
+def get_leaderboard(update, count):
+    return [(username, decayed(value, timestamp)) for username, value, timestamp in store.top(update.message.chat.id, count)]
 
 
-def set_reputation(new_value, update):
-    global reputation, reputation_messages
+# Key of the sender of the message in the history, the user id (prefixed with the chat id if scoped per chat).
+def history_key(update):
+    user_id = update.message.from_user.id
+    return f'{update.message.chat.id}/{user_id}' if config.get('reputation_per_chat', False) else str(user_id)
 
+
+def record_history(update, delta, cause):
+    if delta != 0: history.append(history_key(update), delta, cause)
+
+
+# Users of the chat whose score rose and fell the most in the given time, as two lists of (full name, delta).
+# Only users seen in the chat are included, the history doesn't know who is in which chat.
+def get_biggest_movers(update, seconds = 7 * 24 * 60 * 60, count = 5):
+    chat_id  = update.message.chat.id
+    per_chat = config.get('reputation_per_chat', False)
+    names    = {
+        f'{chat_id}/{user_id}' if per_chat else str(user_id): full_name
+        for user_id, (username, full_name) in list(get_chat_members(chat_id).items())
+    }
+
+    risers, fallers = history.biggest_movers(time.time() - seconds, count = count, users = names)
+    return [(names[key], delta) for key, delta in risers], [(names[key], delta) for key, delta in fallers]
+
+
+# Score of the sender of the message at the end of each of the last days, oldest first.
+def get_reputation_trend(update, days = 14):
+    bucket = 24 * 60 * 60
+    start  = (int(time.time()) // bucket - days + 1) * bucket
+    deltas = history.trend(history_key(update), start, start + days * bucket, bucket)
+
+    scores = [get_reputation(update)]
+    for delta in reversed(deltas[1:]): scores.append(scores[-1] - delta)
+
+    return list(reversed(scores))
+
+
+# cause: what caused the change, e.g. 'gct_passed' or 'rule:patriot', recorded in the history.
+def update_reputation(delta, update, cause = 'unknown'):
+    set_reputation(get_reputation(update) + delta, update, cause)
+
+
+def set_reputation(new_value, update, cause = 'unknown'):
+    global reputation_messages
+
+    now          = time.time()
     display_name = update.message.from_user.full_name
-    username     = update.message.from_user.username
 
-    if username not in reputation: reputation[username] = 0.0
+    # The threshold messages compare against the score as it was last set, so thresholds crossed by decay in the
+    # meantime are announced now.
+    old_reputation, timestamp = store.get(update)
+    delta = new_value - old_reputation
 
-    old_reputation = reputation[username]
-    delta          = new_value - old_reputation
-    reputation[username] = new_value
+    store.set(update, new_value, now)
+    record_history(update, new_value - decayed(old_reputation, timestamp, now), cause)
 
     reply = []
     for value, actions in reputation_messages.items():
-        lower = min(old_reputation, reputation[username])
-        upper = max(old_reputation, reputation[username])
+        lower = min(old_reputation, new_value)
+        upper = max(old_reputation, new_value)
 
         if lower <= value < upper:
             message = actions[0] if delta < 0 else actions[1]
             reply.append(message(display_name))
 
     if len(reply) > 0: send_reply(update, None, '\n'.join(reply))
-    save_reputations()
 
 
 def reset_reputation(update):
-    global reputation
-
     display_name = update.message.from_user.full_name
-    username     = update.message.from_user.username
-    reputation[username] = 0
-
-    send_reply(update, None, f'Xi Jinping has purged all memories of {display_name}.')
-    save_reputations()
-
 
-def load_reputations():
-    global reputation
+    record_history(update, -get_reputation(update), 'reset')
+    store.set(update, 0, time.time())
 
-    json_path = os.path.join(asset_folder, 'reputation.json')
+    send_reply(update, None, f'Xi Jinping has purged all memories of {display_name}.')
 
-    if not os.path.exists(json_path):
-        with open(json_path, 'w') as handle:
-            handle.write('{}')
 
-    with open(json_path, 'r') as handle:
-        reputation = collections.OrderedDict(map(
-            lambda kv: (str(kv[0]), float(kv[1])),
-            json.load(handle).items()
-        ))
+# read_only: for --profile-startup, which runs next to the running bot. Reads the scores and indexes the history the
+# same way, but leaves the files alone, since loading them repairs and appends to them.
+def load_reputations(read_only = False):
+    store.load(read_only)
+    history.start(read_only)
 
 
+# Writes out all pending changes right away.
 def save_reputations():
-    global reputation
-
-    with open(os.path.join(asset_folder, 'reputation.json'), 'w') as handle:
-        json.dump(reputation, handle, indent = 4)
+    store.flush()
+    history.flush()
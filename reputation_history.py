@@ -0,0 +1,261 @@
+# Append-only history of every score change, for trends and "biggest movers" queries.
+# Changes are stored column by column in fixed-width binary files (user index, timestamp, delta, cause id), so a
+# record takes 14 bytes and a query only reads the columns it needs. The files are memory-mapped for reads and a time
+# range is found by binary search on the timestamps, which only ever increase.
+# Users and causes are numbered in the order they first appear, with their names appended to small text files.
+# The record numbers of every user are also kept in memory (4 bytes per record, rebuilt from the users column on
+# start), so the queries about specific users only read those users' records.
+
+import atexit
+import bisect
+import collections
+import mmap
+import os
+import time
+from _thread import start_new_thread
+from array import array
+from contextlib import contextmanager
+from threading import Lock
+
+
+# Column name => array type code.
+columns = {
+    'users':      'I', # index into the user names
+    'timestamps': 'I', # seconds since the epoch
+    'deltas':     'f',
+    'causes':     'H'  # index into the cause names
+}
+
+
+class reputation_history:
+    def __init__(self, folder, flush_interval = 5.0):
+        self.folder         = folder
+        self.flush_interval = flush_interval
+
+        self.lock    = Lock()
+        self.pending = { name: array(code) for name, code in columns.items() }
+
+        self.users  = self.load_names('users.txt')
+        self.causes = self.load_names('causes.txt')
+        self.user_indices  = { name: index for index, name in enumerate(self.users) }
+        self.cause_indices = { name: index for index, name in enumerate(self.causes) }
+
+        self.user_records   = collections.defaultdict(lambda: array('I')) # user index => record numbers, ascending
+        self.record_count   = 0                                             # records stored and pending
+        self.last_timestamp = 0
+        self.running        = False
+
+
+    def column_path(self, name):
+        return os.path.join(self.folder, f'{name}.bin')
+
+
+    def load_names(self, file_name):
+        file_path = os.path.join(self.folder, file_name)
+        if not os.path.exists(file_path): return []
+
+        with open(file_path, 'r', encoding = 'utf-8') as handle:
+            return handle.read().splitlines()
+
+
+    # Number of the name, appending it to the file if it's new.
+    def name_index(self, name, names, indices, file_name):
+        index = indices.get(name)
+        if index is not None: return index
+
+        with open(os.path.join(self.folder, file_name), 'a', encoding = 'utf-8') as handle:
+            handle.write(name + '\n')
+
+        index = indices[name] = len(names)
+        names.append(name)
+        return index
+
+
+    # read_only: only indexes the stored records (see load_reputations), without repairing the columns or writing.
+    def start(self, read_only = False):
+        if read_only:
+            self.index_users()
+            return
+
+        os.makedirs(self.folder, exist_ok = True)
+        self.repair()
+        self.index_users()
+
+        if not self.running:
+            self.running = True
+            start_new_thread(self.thread_loop, ())
+            atexit.register(self.flush)
+
+
+    # If the bot was killed halfway through a flush, some columns may have more records than others (or end in a
+    # partial record). Cut them all back to the last complete record.
+    def repair(self):
+        count = min(self.stored_records(name) for name in columns)
+
+        for name, code in columns.items():
+            file_path = self.column_path(name)
+            size      = count * array(code).itemsize
+
+            if os.path.exists(file_path) and os.path.getsize(file_path) != size:
+                with open(file_path, 'r+b') as handle: handle.truncate(size)
+
+
+    def index_users(self):
+        self.flush()
+
+        with self.lock:
+            users     = array(columns['users'])
+            file_path = self.column_path('users')
+
+            if os.path.exists(file_path):
+                with open(file_path, 'rb') as handle: data = handle.read()
+
+                # Only complete records, the column isn't repaired when reading only.
+                users.frombytes(data[:len(data) - len(data) % users.itemsize])
+
+            # Records appended since the flush are still pending.
+            users.extend(self.pending['users'])
+
+            self.user_records = collections.defaultdict(lambda: array('I'))
+            for record, user in enumerate(users): self.user_records[user].append(record)
+
+            self.record_count = len(users)
+
+
+    def stored_records(self, name):
+        file_path = self.column_path(name)
+        return os.path.getsize(file_path) // array(columns[name]).itemsize if os.path.exists(file_path) else 0
+
+
+    def append(self, user, delta, cause):
+        with self.lock:
+            user_index  = self.name_index(user,  self.users,  self.user_indices,  'users.txt')
+            cause_index = self.name_index(cause, self.causes, self.cause_indices, 'causes.txt')
+
+            # Keep the timestamps sorted even if the clock is adjusted backwards.
+            self.last_timestamp = max(self.last_timestamp, int(time.time()))
+
+            self.pending['users'].append(user_index)
+            self.pending['timestamps'].append(self.last_timestamp)
+            self.pending['deltas'].append(delta)
+            self.pending['causes'].append(cause_index)
+
+            self.user_records[user_index].append(self.record_count)
+            self.record_count += 1
+
+
+    def flush(self):
+        with self.lock:
+            if len(self.pending['users']) == 0: return
+
+            for name, values in self.pending.items():
+                with open(self.column_path(name), 'ab') as handle: values.tofile(handle)
+
+            self.pending = { name: array(code) for name, code in columns.items() }
+
+
+    def thread_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+
+            try: self.flush()
+            except Exception as e: print(f'[Reputation History]: Failed to write the history: {e}')
+
+
+    # Memory maps the stored columns as typed memoryviews, after writing out pending records.
+    @contextmanager
+    def mapped(self):
+        self.flush()
+
+        handles, maps, views, records = [], [], dict(), dict()
+
+        try:
+            for name, code in columns.items():
+                file_path = self.column_path(name)
+
+                if not os.path.exists(file_path) or os.path.getsize(file_path) == 0:
+                    views[name] = memoryview(array(code))
+                    continue
+
+                handles.append(open(file_path, 'rb'))
+                maps.append(mmap.mmap(handles[-1].fileno(), 0, access = mmap.ACCESS_READ))
+                views[name] = memoryview(maps[-1]).cast(code)
+
+            # A flush may be running on another thread, only use the records present in every column.
+            count   = min(len(view) for view in views.values())
+            records = { name: view[:count] for name, view in views.items() }
+
+            yield records
+        finally:
+            # The views have to be released before the maps can be closed.
+            for view in list(records.values()) + list(views.values()): view.release()
+            for handle in maps + handles: handle.close()
+
+
+    # (first, last) record index of the records between start and end (seconds since the epoch).
+    @staticmethod
+    def time_range(timestamps, start, end):
+        return bisect.bisect_left(timestamps, start), bisect.bisect_left(timestamps, end)
+
+
+    # Record numbers of the user (a name) between first and last, the record range of a time range.
+    def user_range(self, user, first, last):
+        user_index = self.user_indices.get(user)
+        if user_index is None: return []
+
+        with self.lock: records = self.user_records[user_index]
+
+        # The records are numbered in the order they were appended, so the ones in range are a contiguous slice.
+        return records[bisect.bisect_left(records, first) : bisect.bisect_left(records, last)]
+
+
+    # Total change per user between start and end, as { user: delta }.
+    # With users (a collection of names) only their records are read, otherwise every record in the time range.
+    def totals(self, start, end = None, users = None):
+        end    = time.time() + 1 if end is None else end
+        totals = collections.defaultdict(float)
+
+        with self.mapped() as view:
+            first, last = self.time_range(view['timestamps'], start, end)
+
+            if users is not None:
+                deltas = view['deltas']
+                for user in users:
+                    records = self.user_range(user, first, last)
+                    if len(records) > 0: totals[user] = sum(deltas[record] for record in records)
+
+                return totals
+
+            users, deltas = view['users'][first:last], view['deltas'][first:last]
+            for user, delta in zip(users, deltas): totals[user] += delta
+
+            users.release()
+            deltas.release()
+
+        return { self.users[user]: delta for user, delta in totals.items() }
+
+
+    # The users whose score rose and fell the most between start and end, as two lists of (user, delta).
+    def biggest_movers(self, start, end = None, count = 5, users = None):
+        totals = self.totals(start, end, users)
+
+        ordered = sorted(totals.items(), key = lambda kv: kv[1])
+        risers  = [kv for kv in reversed(ordered[-count:]) if kv[1] > 0]
+        fallers = [kv for kv in ordered[:count] if kv[1] < 0]
+
+        return risers, fallers
+
+
+    # Change of the score of user per bucket (in seconds) between start and end, as a list of deltas.
+    def trend(self, user, start, end = None, bucket = 24 * 60 * 60):
+        end    = time.time() + 1 if end is None else end
+        result = [0.0] * max(1, int((end - start + bucket - 1) // bucket))
+
+        with self.mapped() as view:
+            first, last = self.time_range(view['timestamps'], start, end)
+            timestamps, deltas = view['timestamps'], view['deltas']
+
+            for record in self.user_range(user, first, last):
+                result[int((timestamps[record] - start) // bucket)] += deltas[record]
+
+        return result
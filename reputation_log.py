@@ -0,0 +1,175 @@
+# Append-only log of reputation changes, so a score change appends a single line instead of rewriting the entire
+# reputation table. Appended records are fsynced in groups by a background thread, and once the log grows large it is
+# compacted into the snapshot (reputation.json). On startup the snapshot is loaded and the log is replayed on top of it.
+#
+# Records store the new value rather than the delta, so replaying a record more than once (e.g. after a crash during
+# compaction) is harmless.
+# The table maps usernames to (value, time of the last change), the time being used for decay (see reputation.py).
+
+import atexit
+import collections
+import json
+import os
+import time
+from _thread import start_new_thread
+from threading import Lock
+
+
+class reputation_log:
+    # snapshot: function returning a copy of the current reputation table, used when compacting.
+    def __init__(self, snapshot_path, snapshot, flush_interval = 1.0, compact_after = 1000):
+        self.snapshot_path   = snapshot_path
+        self.log_path        = snapshot_path + '.log'
+        self.compacting_path = snapshot_path + '.log.compacting'
+        self.snapshot        = snapshot
+        self.flush_interval  = flush_interval
+        self.compact_after   = compact_after
+
+        self.lock    = Lock()
+        self.handle  = None
+        self.pending = 0 # records not yet fsynced
+        self.records = 0 # records in the log since the last compaction
+        self.running = False
+
+
+    # Loads the snapshot, replays the log on top of it and starts appending to the log. Returns the reputation table.
+    # The log is opened for appending and kept as it is, only compaction ever starts a new one: anything else still
+    # appending to it (or a run that stopped without compacting) would lose its records otherwise. Replaying them again
+    # on the next start is harmless, and they count towards the next compaction.
+    def load(self):
+        table    = read_snapshot(self.snapshot_path)
+        replayed = replay_log(self.compacting_path, table)
+        logged   = replay_log(self.log_path, table)
+
+        with self.lock:
+            # A compaction was interrupted after moving the log aside, its records aren't in the snapshot yet.
+            if os.path.exists(self.compacting_path):
+                write_snapshot(self.snapshot_path, table)
+                os.remove(self.compacting_path)
+
+            if self.handle is not None: self.handle.close()
+            self.handle = open(self.log_path, 'a', encoding = 'utf-8')
+
+            # Start on a new line if the last run was killed halfway through a record.
+            if self.handle.tell() > 0 and not ends_with_newline(self.log_path): self.handle.write('\n')
+
+            self.pending = 0
+            self.records = logged
+
+            if not self.running:
+                self.running = True
+                start_new_thread(self.thread_loop, ())
+                atexit.register(self.flush)
+
+        if replayed + logged > 0: print(f'[Reputation]: Replayed {replayed + logged} logged changes.')
+        return table
+
+
+    def append(self, username, value, timestamp):
+        line = json.dumps([username, value, timestamp], ensure_ascii = False) + '\n'
+
+        with self.lock:
+            self.handle.write(line)
+            self.pending += 1
+            self.records += 1
+
+
+    # The fsync happens under the lock, so compaction (possibly on the other thread during exit) can't close the handle
+    # in the meantime. Appends only wait for it once per flush interval.
+    def flush(self):
+        with self.lock:
+            if self.pending == 0: return
+
+            self.handle.flush()
+            os.fsync(self.handle.fileno())
+            self.pending = 0
+
+
+    # Moves the current log aside, writes a fresh snapshot and then drops the old log.
+    # Every record in the old log was applied to the table before it was appended, so the snapshot taken after
+    # moving the log includes all of them. Records appended meanwhile go to the new log.
+    def compact(self):
+        with self.lock:
+            self.handle.flush()
+            os.fsync(self.handle.fileno())
+            self.handle.close()
+
+            os.replace(self.log_path, self.compacting_path)
+
+            self.handle  = open(self.log_path, 'w', encoding = 'utf-8')
+            self.pending = 0
+            self.records = 0
+
+        write_snapshot(self.snapshot_path, self.snapshot())
+        os.remove(self.compacting_path)
+
+
+    def thread_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+
+            try:
+                self.flush()
+                if self.records >= self.compact_after: self.compact()
+            except Exception as e:
+                print(f'[Reputation]: Failed to write the reputation log: {e}')
+
+
+# The current reputation table, without writing anything or starting to append.
+def read_table(snapshot_path):
+    table = read_snapshot(snapshot_path)
+    replay_log(snapshot_path + '.log.compacting', table)
+    replay_log(snapshot_path + '.log', table)
+    return table
+
+
+# Older snapshots only store the value, those scores count as last changed when the snapshot was written.
+def read_snapshot(file_path):
+    if not os.path.exists(file_path): return collections.OrderedDict()
+
+    written = os.path.getmtime(file_path)
+
+    with open(file_path, 'r') as handle:
+        return collections.OrderedDict(
+            (str(key), (float(entry[0]), float(entry[1])) if isinstance(entry, list) else (float(entry), written))
+            for key, entry in json.load(handle).items()
+        )
+
+
+# Written to a temporary file first so a crash never leaves a half-written snapshot behind.
+# One user per line, so the file stays readable without spreading every [value, time] pair over four lines.
+def write_snapshot(file_path, table):
+    temporary_path = file_path + '.tmp'
+
+    with open(temporary_path, 'w') as handle:
+        lines = (f'    {json.dumps("null" if key is None else str(key))}: {json.dumps(list(entry))}' for key, entry in table.items())
+        handle.write('{\n' + ',\n'.join(lines) + '\n}\n')
+        handle.flush()
+        os.fsync(handle.fileno())
+
+    os.replace(temporary_path, file_path)
+
+
+def ends_with_newline(file_path):
+    with open(file_path, 'rb') as handle:
+        handle.seek(-1, os.SEEK_END)
+        return handle.read(1) == b'\n'
+
+
+# Applies every record in the log to table and returns the number of records applied.
+def replay_log(file_path, table):
+    if not os.path.exists(file_path): return 0
+
+    replayed = 0
+
+    with open(file_path, 'r', encoding = 'utf-8') as handle:
+        for line in handle:
+            # The last line may be incomplete if the bot was killed while writing it.
+            try: username, value, timestamp = json.loads(line)
+            except ValueError: continue
+
+            # Same conversion as the snapshot, where a missing username ends up as the key 'null'.
+            table['null' if username is None else str(username)] = (float(value), float(timestamp))
+            replayed += 1
+
+    return replayed
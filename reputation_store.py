@@ -0,0 +1,435 @@
+# Storage backends for the social credit scores used by reputation.py, selected with the 'reputation_backend' config
+# key ('json', the default, or 'sqlite').
+# With 'reputation_per_chat' enabled every chat keeps its own scores, otherwise a user has one score everywhere.
+#
+# Scores are stored as (value, time of the last change), reputation.py applies the decay.
+#
+# Both backends provide:
+#   load()                          read the stored scores (and start persisting changes)
+#   get(update)                     (value, time) of the sender of the message
+#   score(chat id, user id, name)   (value, time) of any user in a chat
+#   set(update, value, time)        change the score of the sender of the message
+#   negative_users(update, limit)   up to limit random (username, user id) pairs of users with a negative score in
+#                                   the chat
+#   negative_members(update, users) the user ids out of { user id: username } with a negative score in the chat
+#   all_scores()                    (chat id, username, value, time) of every stored score, chat id 0 if not per chat
+#   rank(update)                    (rank, number of ranked users) of the sender in the chat, rank None if unranked
+#   top(chat id, count, start)      the count highest scores in the chat from the given rank, as (username, value, time)
+#   flush()                         write out all pending changes
+#
+# Only users with a username are ranked. Ties are ordered by username.
+
+import atexit
+import collections
+import math
+import os
+import random
+import sqlite3
+import time
+from _thread import start_new_thread
+from threading import Lock
+
+from rank_index import rank_index
+from reputation_log import reputation_log, read_table
+from userid_map import get_id
+
+
+# Chat id used for scores that aren't scoped to a chat.
+global_chat = 0
+
+
+# Ranking key of a score that decays at decay_rate (see reputation.py). Every score decays at the same rate, so their
+# order only changes when one is set. Comparing the scores as they would be at any fixed time gives that order, but
+# e^(rate * time) overflows for times far from that point, so the key is the logarithm of the magnitude instead:
+# sign(value) * (30 + ln |value| + rate * time). The 30 keeps the magnitude positive for every value not treated as 0.
+def rank_key(value, timestamp, decay_rate):
+    if abs(value) < 1e-9: return 0.0
+    return math.copysign(30.0 + math.log(abs(value)) + decay_rate * timestamp, value)
+
+
+# Set with constant time insertion, removal and random sampling.
+class sampling_set:
+    def __init__(self):
+        self.items     = []
+        self.positions = dict() # item => index in items
+
+
+    def __len__(self):
+        return len(self.items)
+
+
+    def __contains__(self, item):
+        return item in self.positions
+
+
+    def add(self, item):
+        if item in self.positions: return
+
+        self.positions[item] = len(self.items)
+        self.items.append(item)
+
+
+    def discard(self, item):
+        position = self.positions.pop(item, None)
+        if position is None: return
+
+        # Fill the hole with the last item.
+        last = self.items.pop()
+        if position < len(self.items):
+            self.items[position]  = last
+            self.positions[last] = position
+
+
+    def sample(self, count):
+        return random.sample(self.items, min(count, len(self.items)))
+
+
+# Keeps every score in memory, persisted as reputation.json plus a log of changes (see reputation_log).
+# Scores are keyed by username, or by 'chat id/username' when scoped per chat.
+# The usernames with a negative score and the ranking are indexed per chat (or under '' when not scoped per chat).
+class json_reputation_store:
+    # Nothing is persisted if json_path is None.
+    def __init__(self, json_path, per_chat = False, decay_rate = 0.0):
+        self.table      = collections.OrderedDict()
+        self.negative   = collections.defaultdict(sampling_set)
+        self.rankings   = collections.defaultdict(rank_index)
+        self.per_chat   = per_chat
+        self.decay_rate = decay_rate
+        self.log        = reputation_log(json_path, lambda: dict(self.table)) if json_path else None
+
+
+    def key(self, chat_id, username):
+        return f'{chat_id}/{username}' if self.per_chat else username
+
+
+    def scope(self, chat_id):
+        return str(chat_id) if self.per_chat else ''
+
+
+    def index(self, scope, username, value, timestamp):
+        if username in (None, '', 'null', 'None'): return
+
+        if value < 0: self.negative[scope].add(username)
+        else: self.negative[scope].discard(username)
+
+        self.rankings[scope].set(username, rank_key(value, timestamp, self.decay_rate))
+
+
+    # read_only: only reads the scores (see load_reputations), nothing is written and the log isn't opened.
+    def load(self, read_only = False):
+        if self.log: self.table = read_table(self.log.snapshot_path) if read_only else self.log.load()
+
+        scores = collections.defaultdict(list)
+
+        self.negative.clear()
+        for key, (value, timestamp) in self.table.items():
+            scope, username = str(key).partition('/')[::2] if self.per_chat else ('', key)
+            if username in (None, '', 'null', 'None'): continue
+
+            if value < 0: self.negative[scope].add(username)
+            scores[scope].append((username, rank_key(value, timestamp, self.decay_rate)))
+
+        # Building the skip lists in one go is much cheaper than inserting every score.
+        self.rankings.clear()
+        for scope, items in scores.items(): self.rankings[scope].build(items)
+
+
+    def get(self, update):
+        return self.score(update.message.chat.id, update.message.from_user.id, update.message.from_user.username)
+
+
+    def score(self, chat_id, user_id, username):
+        return self.table.get(self.key(chat_id, username), (0.0, 0.0))
+
+
+    def set(self, update, value, timestamp):
+        chat_id  = update.message.chat.id
+        username = update.message.from_user.username
+        key      = self.key(chat_id, username)
+
+        self.table[key] = (value, timestamp)
+        self.index(self.scope(chat_id), username, value, timestamp)
+        if self.log: self.log.append(key, value, timestamp)
+
+
+    def negative_users(self, update, limit = 100):
+        usernames = self.negative[self.scope(update.message.chat.id)].sample(limit)
+        return [(username, get_id(username)) for username in usernames]
+
+
+    def negative_members(self, update, users):
+        negative = self.negative[self.scope(update.message.chat.id)]
+        return [user_id for user_id, username in users.items() if username in negative]
+
+
+    def all_scores(self):
+        for key, (value, timestamp) in list(self.table.items()):
+            if self.per_chat:
+                chat_id, _, username = str(key).partition('/')
+                if chat_id.lstrip('-').isdigit(): yield int(chat_id), username, value, timestamp
+            else:
+                yield global_chat, key, value, timestamp
+
+
+    def rank(self, update):
+        ranking = self.rankings[self.scope(update.message.chat.id)]
+        return ranking.rank(update.message.from_user.username), len(ranking)
+
+
+    def top(self, chat_id, count, start = 0):
+        return [
+            (username, *self.table[self.key(chat_id, username)])
+            for username, _ in self.rankings[self.scope(chat_id)].top(count, start)
+        ]
+
+
+    def flush(self):
+        if self.log: self.log.compact()
+
+
+# Keeps the scores in an SQLite database, keyed by (chat id, user id), so only the scores that are used are in memory.
+# Changes are collected in memory and written in a single transaction by a background thread.
+# The ranking is answered from an index on (chat id, rank key), so it doesn't need the scores in memory either. Counting
+# the users ranked above someone walks that part of the index, which is cheap but not logarithmic like the skip list.
+class sqlite_reputation_store:
+    # json_path: reputation.json to migrate the scores from when the database doesn't exist yet.
+    def __init__(self, db_path, json_path = None, per_chat = False, flush_interval = 1.0, decay_rate = 0.0):
+        self.db_path        = db_path
+        self.json_path      = json_path
+        self.per_chat       = per_chat
+        self.flush_interval = flush_interval
+        self.decay_rate     = decay_rate
+
+        self.lock       = Lock()
+        self.connection = None
+        self.pending    = dict() # (chat id, user id) => (username, value, time)
+        self.running    = False
+
+
+    def chat(self, update):
+        return update.message.chat.id if self.per_chat else global_chat
+
+
+    # read_only: opens the database read-only (see load_reputations), without creating, migrating or writing to it.
+    def load(self, read_only = False):
+        is_new = not os.path.exists(self.db_path)
+
+        if read_only:
+            if is_new: return
+
+            self.connection = sqlite3.connect(f'file:{self.db_path}?mode=ro', uri = True, check_same_thread = False)
+            self.connection.execute('SELECT COUNT(*) FROM reputation').fetchone()
+            return
+
+        with self.lock:
+            self.connection = sqlite3.connect(self.db_path, check_same_thread = False)
+            self.connection.execute('PRAGMA journal_mode = WAL')
+            self.connection.execute('PRAGMA synchronous = NORMAL')
+
+            with self.connection:
+                self.connection.execute('''
+                    CREATE TABLE IF NOT EXISTS reputation (
+                        chat_id  INTEGER NOT NULL,
+                        user_id  INTEGER NOT NULL,
+                        username TEXT,
+                        value    REAL    NOT NULL,
+                        updated  REAL    NOT NULL,
+                        PRIMARY KEY (chat_id, user_id)
+                    ) WITHOUT ROWID
+                ''')
+                self.connection.execute('CREATE INDEX IF NOT EXISTS negative_reputation ON reputation (chat_id) WHERE value < 0')
+
+                # Migrated scores of users whose id was unknown at the time, looked up by username instead.
+                self.connection.execute('''
+                    CREATE TABLE IF NOT EXISTS legacy_reputation (
+                        username TEXT PRIMARY KEY,
+                        value    REAL NOT NULL,
+                        updated  REAL NOT NULL
+                    ) WITHOUT ROWID
+                ''')
+
+                # Databases created before scores decayed have no update times, their scores start decaying now.
+                for table in ('reputation', 'legacy_reputation'):
+                    columns = [row[1] for row in self.connection.execute(f'PRAGMA table_info({table})')]
+
+                    if 'updated' not in columns:
+                        self.connection.execute(f'ALTER TABLE {table} ADD COLUMN updated REAL NOT NULL DEFAULT 0')
+                        self.connection.execute(f'UPDATE {table} SET updated = ?', (time.time(),))
+
+                self.load_ranking()
+
+            if is_new and self.json_path and os.path.exists(self.json_path): self.migrate_from_json(self.json_path)
+
+            if not self.running:
+                self.running = True
+                start_new_thread(self.thread_loop, ())
+                atexit.register(self.flush)
+
+
+    # Adds the rank keys to databases created before the ranking, and recomputes them if the decay rate changed.
+    # Must be called in a transaction.
+    def load_ranking(self):
+        self.connection.execute('CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value) WITHOUT ROWID')
+
+        columns = [row[1] for row in self.connection.execute('PRAGMA table_info(reputation)')]
+        if 'rank_key' not in columns: self.connection.execute('ALTER TABLE reputation ADD COLUMN rank_key REAL NOT NULL DEFAULT 0')
+
+        self.connection.execute('CREATE INDEX IF NOT EXISTS ranking ON reputation (chat_id, rank_key DESC, username) WHERE username IS NOT NULL')
+
+        row = self.connection.execute("SELECT value FROM settings WHERE name = 'decay_rate'").fetchone()
+        if row is not None and row[0] == self.decay_rate and 'rank_key' in columns: return
+
+        self.connection.create_function('rank_key', 3, rank_key, deterministic = True)
+        self.connection.execute('UPDATE reputation SET rank_key = rank_key(value, updated, ?)', (self.decay_rate,))
+        self.connection.execute("INSERT OR REPLACE INTO settings (name, value) VALUES ('decay_rate', ?)", (self.decay_rate,))
+
+
+    # Copies the scores from reputation.json (and its change log) into the global scores. Requires the user ids to
+    # have been loaded, since the JSON file is keyed by username.
+    def migrate_from_json(self, json_path):
+        table = read_table(json_path)
+
+        rows, legacy_rows = [], []
+        for username, (value, timestamp) in table.items():
+            if username in ('null', 'None'): continue
+
+            user_id = get_id(username)
+            if user_id is None: legacy_rows.append((username, value, timestamp))
+            else: rows.append((global_chat, int(user_id), username, value, timestamp, rank_key(value, timestamp, self.decay_rate)))
+
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO reputation (chat_id, user_id, username, value, updated, rank_key) VALUES (?, ?, ?, ?, ?, ?)', rows)
+            self.connection.executemany('INSERT OR REPLACE INTO legacy_reputation (username, value, updated) VALUES (?, ?, ?)', legacy_rows)
+
+        print(f'[Reputation]: Migrated {len(rows)} scores from {json_path}, {len(legacy_rows)} of users with unknown ids.')
+
+
+    def get(self, update):
+        return self.score(update.message.chat.id, update.message.from_user.id, update.message.from_user.username)
+
+
+    # Chat scores start out at the user's global score, which is where migrated scores end up.
+    def score(self, chat_id, user_id, username):
+        key = (chat_id if self.per_chat else global_chat, user_id)
+
+        with self.lock:
+            entry = self.pending.get(key)
+            if entry is not None: return entry[1:]
+
+            query = 'SELECT value, updated FROM reputation WHERE chat_id = ? AND user_id = ?'
+            row   = self.connection.execute(query, key).fetchone()
+
+            if row is None and key[0] != global_chat:
+                row = self.connection.execute(query, (global_chat, user_id)).fetchone()
+
+            if row is None and username is not None:
+                row = self.connection.execute('SELECT value, updated FROM legacy_reputation WHERE username = ?', (username,)).fetchone()
+
+        return tuple(row) if row is not None else (0.0, 0.0)
+
+
+    def set(self, update, value, timestamp):
+        user = update.message.from_user
+
+        with self.lock:
+            self.pending[(self.chat(update), user.id)] = (user.username, value, timestamp)
+
+
+    # A window of limit negative scores in the ranking index, starting at a random rank key and wrapping around, so
+    # only those rows are read instead of sorting every negative score. Changes show up once they are flushed.
+    def negative_users(self, update, limit = 100):
+        chat   = self.chat(update)
+        window = 'SELECT username, user_id FROM reputation WHERE chat_id = ? AND rank_key < 0 AND username IS NOT NULL'
+
+        with self.lock:
+            lowest  = self.connection.execute('SELECT MIN(rank_key) FROM reputation WHERE chat_id = ? AND rank_key < 0 AND username IS NOT NULL', (chat,)).fetchone()[0]
+            highest = self.connection.execute('SELECT MAX(rank_key) FROM reputation WHERE chat_id = ? AND rank_key < 0 AND username IS NOT NULL', (chat,)).fetchone()[0]
+            if lowest is None: return []
+
+            start = random.uniform(lowest, highest)
+            rows  = self.connection.execute(f'{window} AND rank_key <= ? ORDER BY rank_key DESC LIMIT ?', (chat, start, limit)).fetchall()
+
+            if len(rows) < limit:
+                rows += self.connection.execute(f'{window} AND rank_key > ? ORDER BY rank_key DESC LIMIT ?', (chat, start, limit - len(rows))).fetchall()
+
+        random.shuffle(rows)
+        return rows
+
+
+    # Looked up by primary key, in batches below SQLite's limit on query parameters. Pending changes take precedence.
+    def negative_members(self, update, users):
+        chat   = self.chat(update)
+        result = []
+
+        with self.lock:
+            pending = { user_id: value for (chat_id, user_id), (_, value, _) in self.pending.items() if chat_id == chat }
+            stored  = [user_id for user_id in users if user_id not in pending]
+
+            for start in range(0, len(stored), 500):
+                batch = stored[start:start + 500]
+                query = f'SELECT user_id FROM reputation WHERE chat_id = ? AND value < 0 AND user_id IN ({", ".join("?" * len(batch))})'
+                result += [row[0] for row in self.connection.execute(query, (chat, *batch))]
+
+        return result + [user_id for user_id, value in pending.items() if user_id in users and value < 0]
+
+
+    def all_scores(self):
+        self.flush()
+
+        with self.lock:
+            return self.connection.execute('SELECT chat_id, username, value, updated FROM reputation WHERE username IS NOT NULL').fetchall()
+
+
+    def rank(self, update):
+        self.flush()
+
+        chat_id = self.chat(update)
+
+        with self.lock:
+            count = self.connection.execute('SELECT COUNT(*) FROM reputation WHERE chat_id = ? AND username IS NOT NULL', (chat_id,)).fetchone()[0]
+            row   = self.connection.execute(
+                'SELECT rank_key, username FROM reputation WHERE chat_id = ? AND user_id = ? AND username IS NOT NULL',
+                (chat_id, update.message.from_user.id)
+            ).fetchone()
+
+            if row is None: return None, count
+
+            above = self.connection.execute(
+                'SELECT COUNT(*) FROM reputation WHERE chat_id = ? AND username IS NOT NULL AND rank_key >= ? AND (rank_key > ? OR username < ?)',
+                (chat_id, row[0], row[0], row[1])
+            ).fetchone()[0]
+
+        return above + 1, count
+
+
+    def top(self, chat_id, count, start = 0):
+        self.flush()
+
+        with self.lock:
+            return self.connection.execute(
+                'SELECT username, value, updated FROM reputation WHERE chat_id = ? AND username IS NOT NULL ORDER BY rank_key DESC, username LIMIT ? OFFSET ?',
+                (chat_id if self.per_chat else global_chat, count, start)
+            ).fetchall()
+
+
+    def flush(self):
+        with self.lock:
+            if not self.pending: return
+
+            rows = [
+                (chat_id, user_id, username, value, timestamp, rank_key(value, timestamp, self.decay_rate))
+                for (chat_id, user_id), (username, value, timestamp) in self.pending.items()
+            ]
+
+            with self.connection:
+                self.connection.executemany('INSERT OR REPLACE INTO reputation (chat_id, user_id, username, value, updated, rank_key) VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+            self.pending = dict()
+
+
+    def thread_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+
+            try: self.flush()
+            except Exception as e: print(f'[Reputation]: Failed to write the reputation database: {e}')
@@ -4,8 +4,12 @@ from typing import Union, Callable, List, Tuple
 
 from common import *
 from text_matchers import *
+from message_context import get_message_context
+from file_watcher import watch_file
+from rule_profiler import profiler
 from reputation import *
 
+import json
 import re
 import random
 import time
@@ -35,10 +39,10 @@ def score_changed_message(amount):
 
 
 # Changes the score of the person who sent a message by the given amount and sends the given response.
-def change_score(a, b, wrapped = None):
+def change_score(a, b, wrapped = None, cause = 'response'):
     def fn(update):
         amount = random.randint(min(a, b), max(a, b))
-        update_reputation(amount, update)
+        update_reputation(amount, update, cause)
 
         if wrapped is not None: return wrapped(update)
         else: return score_changed_message(amount)(update)
@@ -60,7 +64,7 @@ def zedong_of_the_day(update):
     if not may_post_daily_zedong(update): return '<noresponse>'
     last_zedong_of_the_day[update.effective_chat.id] = time.time()
 
-    image_name = random.choice(os.listdir(path.join(asset_folder, 'mao')))
+    image_name = asset_files.random_file('mao')
     return '<captioned=Today\'s Featured Mao Zedong Image>mao/' + image_name
 
 
@@ -68,19 +72,15 @@ def social_credit_notice(update):
     credit_score = get_reputation(update)
     if credit_score >= 0: return '<noresponse>'
 
-    copypasta = read_text('internet_activity.txt') \
-        .replace('${CRED}', str(credit_score)) \
-        .replace('${CRED_ABS}', str(abs(credit_score)))
-
-    return copypasta
+    return render_text('internet_activity.txt', CRED = credit_score, CRED_ABS = abs(credit_score))
 
 
 def malice_notice(update):
     credit_score = get_reputation(update)
     if credit_score < 25000: return '<noresponse>'
 
-    set_reputation(-10000, update)
-    return read_text('malice_notice.txt').replace('${CRED}', str(int(credit_score)))
+    set_reputation(-10000, update, 'malice_notice')
+    return render_text('malice_notice.txt', CRED = int(credit_score))
 
 
 def bing_chilling_notice(update):
@@ -97,20 +97,22 @@ def bing_chilling_notice(update):
 
         return txt
 
-    return read_text('bing_chilling_notice.txt') \
-        .replace('${CRED}', str(credit_score)) \
-        .replace('${CRIMINAL_LIST_EN}', replace_last(criminal_string, ', ', ' & ')) \
-        .replace('${CRIMINAL_LIST_CN}', replace_last(criminal_string, ', ', ' 和 '))
+    return render_text(
+        'bing_chilling_notice.txt',
+        CRED             = credit_score,
+        CRIMINAL_LIST_EN = replace_last(criminal_string, ', ', ' & '),
+        CRIMINAL_LIST_CN = replace_last(criminal_string, ', ', ' 和 ')
+    )
 
 
-def change_score_on_sentiment(a, b, threshold, wrapped = None):
+def change_score_on_sentiment(a, b, threshold, wrapped = None, cause = 'response'):
     def fn(update):
-        text = normalize_message(update.message.text)
+        polarity = get_message_context(update.message).sentiment
 
-        if sentiment_more_than(threshold)(text):
-            return change_score(a, b, wrapped)(update)
-        if sentiment_less_than(-threshold)(text):
-            return change_score(-a, -b, wrapped)(update)
+        if polarity >= threshold:
+            return change_score(a, b, wrapped, cause)(update)
+        if polarity <= -threshold:
+            return change_score(-a, -b, wrapped, cause)(update)
         else:
             if wrapped is not None: return wrapped(update)
             else: return '<noresponse>'
@@ -118,343 +120,176 @@ def change_score_on_sentiment(a, b, threshold, wrapped = None):
     return fn
 
 
-# Make the message lower case, remove special characters and repeated whitespace and transform all whitespace
-# characters to a single space.
-def normalize_message(message):
-    message = message.lower()
-
-    transformed_message = []
-    for i, char in enumerate(message):
-        # Keep all alphanumeric characters as is.
-        if char.isalnum():
-            transformed_message.append(char)
-            continue
-
-        # Remove excess whitespace.
-        if char.isspace():
-            # Keep whitespace (transforming it to ' ') if the next character isn't a space.
-            if i + 1 >= len(message) or not message[i + 1].isspace():
-                transformed_message.append(' ')
-
-    return ''.join(transformed_message)
-
-
-response_map = [
-    # Messages containing the phrase 'Taiwan number one'.
-    (
-        if_matches(r'taiwan numb[a|e]r? [(one)|1]'),
-        change_score(-250, -500, wrapped = lambda update: 'This is by far the most disgusting thing I\'ve read all day.')
-    ),
-    # Messages that mention John Xina
-    (
-        if_matches('((john)|(jiang)|(zhong)) ((xina)|(china)|(cena)|(cina))'),
-        random_response([
-            (lambda update: '<video>zedongwave.mp4', 0.33),
-            (lambda update: '<video>Bing Chilling.mp4', 0.33),
-            (lambda update: '<video>Good Citizen Test.mp4', 0.33)
-        ])
-    ),
-    # Messages that mention Lenin, Stalin or the Soviet Union.
-    (
-        if_contains_word('lenin', 'stalin', 'soviet'),
-        lambda update: '<video>stalin.mp4'
-    ),
-    # Messages that mention Mao Zedong or the CCP.
-    (
-        logical_or(
-            if_contains_word('mao', 'ccp'),
-            if_contains('zedong', 'communist party')
-        ),
-        change_score(25, 50, wrapped = random_response([
-            (lambda update: '<audio>Red Sun in the Sky.mp3', 1),
-            (lambda update: '<video>zedongwave.mp4', 1),
-            (lambda update: '<video>mao_cat.mp4', 1),
-            (lambda update: '<audio>Red Chiptune in the Sky.mp3', 1),
-            (lambda update: '<audio>延边人民热爱毛主席.mp3', 1),
-            (lambda update: '<audio>延边人民热爱毛主席-wave.mp3', 1),
-            (lambda update: '<audio>The Second Paragraph of Pyrocynical.mp3', 1),
-            (lambda update: '<audio>秋冬之美第二段 王建民.mp3', 1),
-            (lambda update: '<video>patriot.mp4', 1),
-            (zedong_of_the_day, lambda update: 100.0 if may_post_daily_zedong(update) else 0.0)
-        ]))
-    ),
-    # Messages mentioning the Social Credit system.
-    (
-        if_contains_word('credit', 'social score'),
-        change_score(-25, +25, wrapped = random_response([
-            (lambda update: '<image>social_credit.jpg', 0.25),
-            (lambda update: '<video>Good Citizen Test.mp4', 0.25),
-            (lambda update: '<audio>Social Credit Deducted.mp3', 0.25),
-            (lambda update: '<video>patriot.mp4', 0.25)
-        ]))
-    ),
-    # Messages mentioning ice cream.
-    (
-        if_contains_word('bing chilling', 'ice cream', 'bingchilling'),
-        random_response([
-            (lambda update: bing_chilling_notice(update), lambda update: 0.0 if get_reputation(update) >= 0 else 1e12),
-            (lambda update: '<video>Bing Chilling.mp4', 0.25),
-            (lambda update: '<video>Good Citizen Test.mp4', 0.25),
-            (lambda update: read_text(f'bing_chilling_{random.randint(1, 3)}.txt'), 0.33),
-        ])
-    ),
-    # Messages mentioning Winnie the Pooh.
-    (
-        if_contains_word('pooh', 'poohbear', 'winnie'),
-        change_score(-100, -250, wrapped = random_response([
-            (lambda update: '<image>punishment.jpg', 0.6),
-            (lambda update: '<image>dinnertime.jpg', 0.25),
-            (lambda update: 'Choose your next words very carefully, capitalist scum...', 0.25),
-            (lambda update: '<video>india.mp4', 0.1)
-        ]))
-    ),
-    # Mentions of the Uyghurs.
-    (
-        logical_or(
-            if_contains_word('uyghur', 'uygur', 'uyguhr', 'uighur', 'uigur', 'uiguhr'),
-            if_contains_word('xinjiang', 'xinjang')
-        ),
-        change_score(-100, -250, wrapped = random_response([
-            (lambda update: 'There is no war in B̶a̶ ̶S̶i̶n̶g̶ ̶S̶e̶ The Xinjiang Autonomous Area.', 0.65),
-            (lambda update: '<image>punishment.jpg', 0.25),
-            (lambda update: '<video>stfu.mp4', 0.10)
-        ]))
-    ),
-    # Mentions of Tibet or Hong Kong.
-    (
-        if_contains_word('tibet', 'dalai', 'hongkong', 'hong kong'),
-        change_score(-100, -250, wrapped = random_response([
-            (lambda update: 'Rightful Chinese clay.', 0.5),
-            (lambda update: 'Choose your next words very carefully, capitalist scum...', 0.2),
-            (lambda update: '<image>punishment.jpg', 0.2),
-            (lambda update: '<video>stfu.mp4', 0.1)
-        ]))
-    ),
-    # Mentions of Tiananmen Square.
-    (
-        logical_or(
-            if_contains('tianman', 'tianmen', 'tiananman', 'tiananmen', 'tianenman', 'tianenmen'),
-            if_contains_word('1989', 'student protest', 'student protests')
-        ),
-        change_score(-250, -500, wrapped = random_response([
-            (lambda update: 'I don\'t know what you\'re talking about.', 0.65),
-            (lambda update: '<image>punishment.jpg', 0.25),
-            (lambda update: '<video>stfu.mp4', 0.1)
-        ]))
-    ),
-    # Mentions of balloons or spying
-    (
-        logical_or(
-            if_contains_word('bloon', 'bloons'),
-            if_contains('spy', 'baloon', 'balloon')
-        ),
-        random_response([
-            (lambda update: '<video>balloon/' + random.choice(['minuteman.mp4', 'rural.mp4', 'pos.mp4', 'biden.mp4']), 0.5),
-            (lambda update: '<image>balloon/' + random.choice(['bloons.jpg', 'goodnight.jpg', 'norad.jpg', 'redneck.jpg']), 0.5)
-        ])
-    ),
-    # Good night messages
-    (
-        if_contains_word('goodnight', 'good night', 'sleep', 'gn'),
-        lambda update: '<image>balloon/goodnight.jpg'
-    ),
-    # Mentions of Joe Biden.
-    (
-        if_contains_word('biden', 'sleepy joe'),
-        lambda update: '<video>balloon/biden.mp4'
-    ),
-    # Mentions of India.
-    (
-        if_contains_word('india'),
-        change_score(-50, -100, wrapped = random_response([
-            (lambda update: 'Shithole country! China numba one! 🇨🇳🇨🇳🇨🇳🇨🇳🇨🇳', 0.50),
-            (lambda update: '<video>india.mp4', 0.50)
-        ]))
-    ),
-    # Mentions of common electronic brands.
-    (
-        logical_or(
-            if_contains('iphone', 'ipad', 'ipod', 'imac', 'macbook', 'foxconn', 'samsung', 'huawei', 'xiaomi', 'oneplus'),
-            if_contains_word('i phone', 'i pad', 'i pod', 'i mac')
-        ),
-        lambda _: '<image>iphone_factory.jpg'
-    ),
-    # Mentions of disputed waters.
-    (
-        if_contains('china sea', 'chinese sea'),
-        lambda _: 'Rightful Chinese territory! It\'s in the name!'
-    ),
-    # Mentions of tech companies with Chinese alternatives.
-    (
-        if_contains_word('twitter', 'facebook', 'instagram', 'snapchat', 'whatsapp', 'telegram', 'discord'),
-        lambda _: 'Did you mean WeChat?'
-    ),
-    (
-        if_contains_word('amazon'),
-        lambda _: 'Did you mean Aliexpress?'
-    ),
-    # Mentions of the coronavirus.
-    (
-        if_contains('corona', 'covid', 'wuhan', 'bat soup', 'bat soop', 'vaccin'),
-        change_score(-100, -200, wrapped = random_response([
-            (lambda score: 'There is nothing going on in Wuhan. Please mind your own business.', 0.6),
-            (lambda score: 'I could go for some bat soup right about now...', 0.2),
-            (lambda score: '🦇🥣', 0.2)
-        ]))
-    ),
-    # Mentions of human rights.
-    (
-        if_contains_word('human right', 'human rights', 'freedom', 'independence', 'independance', 'free the', 'autonomy', 'autonomous'),
-        change_score(-100, -250, wrapped = lambda update: '<image>punishment.jpg')
-    ),
-    # Mentions of Xi Jinping and the word 'dictator'.
-    (
-        logical_and(
-            if_contains_word('xi', 'jinpin', 'jinping'),
-            if_contains_word('dictator', 'dictatorship', 'supreme leader', 'great leader')
-        ),
-        change_score(-100, -250, wrapped = lambda update: '<video>life_of_xi.mp4')
-    ),
-    # Other mentions of Xi Jinping.
-    (
-        if_contains_word('xi', 'jinpin', 'jinping'),
-        change_score(25, 50, wrapped = random_response([
-            (lambda update: 'Ni Hao!', 0.8),
-            (lambda update: '<video>life_of_xi.mp4', 0.1),
-            (lambda update: '<image>happy_xi.jpg', 0.1)
-        ]))
-    ),
-    # Messages that mention the PRC positively.
-    (
-        logical_and(
-            logical_or(
-                if_matches(r'people\s?s?\s?repu?b?l?i?c? of china'),
-                if_contains_word('prc')
-            ),
-            sentiment_more_than(0.15)
-        ),
-        change_score(25, 50, wrapped = lambda update: 'Long live the Communist Party, long live our Glorious Homeland')
-    ),
-    # Messages that mention the PRC negatively.
-    (
-        logical_and(
-            logical_or(
-                if_matches(r'people\s?s?\s?repu?b?l?i?c? of china'),
-                if_contains_word('prc')
-            ),
-            sentiment_less_than(-0.15)
-        ),
-        change_score(-100, -200, wrapped = lambda update: 'This is simply unacceptable.')
-    ),
-    # Messages that mention the ROC.
-    (
-        logical_or(
-            if_matches(r'repu?b?l?i?c? of china'),
-            if_contains('taiwan'),
-            if_contains_word('roc')
-        ),
-        change_score(-50, -100, wrapped = lambda update: 'There is only one China. Always has been.')
-    ),
-    # Other mentions of China.
-    (
-        if_contains_word('china', 'chinese'),
-        change_score(25, 50, wrapped = random_response([
-            (lambda update: '🇨🇳🇨🇳🇨🇳🇨🇳🇨🇳', 0.5),
-            (lambda update: '<audio>The Second Paragraph of Pyrocynical.mp3', 0.2),
-            (lambda update: '<audio>秋冬之美第二段 王建民.mp3', 0.2),
-            (lambda update: '<video>patriot.mp4', 0.1)
-        ]))
-    ),
-    # Messages containing derogatory terms.
-    (
-        logical_or(
-            if_contains_word('chink', 'ching', 'chong'),
-            if_contains('chingchang', 'chingchong', 'changchong', 'ping pong', 'gook', 'chinaman')
-        ),
-        change_score(-250, -500, wrapped = random_response([
-            (lambda update: '<image>punishment.jpg', 0.5),
-            (lambda update: 'Cease disrespecting Chinese culture immediately.', 0.5)
-        ]))
-    ),
-
-    # Messages containing the word 'LMAO'.
-    (
-        if_contains_word('lmao'),
-        maybe_respond(lambda update: '<image>le_mao.jpg', 0.1)
-    ),
-    # Messages mentioning otters.
-    (
-        if_contains_word('otta', 'otter', 'ottas', 'otters'),
-        change_score(5, 10, wrapped = random_response([
-            (lambda update: '<image>commie.jpg', 0.7),
-            (lambda update: read_text('otta_time.txt'), 0.3)
-        ]))
-    ),
-    # Mentions of capitalism.
-    (
-        if_contains('capitalis'),
-        change_score_on_sentiment(-50, -100, 0.15, wrapped = lambda update: 'Capitalism Bad.')
-    ),
-    # Mentions of communism.
-    (
-        if_contains('communis', 'socialis'),
-        change_score_on_sentiment(25, 50, 0.15, wrapped = random_response([
-            (lambda update: 'Communism Good.', 0.75),
-            (lambda update: '<video>stalin.mp4', 0.25)
-        ]))
-    ),
-    # Messages including the text "shut up"
-    (
-        if_contains_word('shut it', 'shut up', 'stfu', 'shut the fuck up'),
-        lambda update: '<video>stfu.mp4'
-    ),
-    # Messages mentioning gaming.
-    (
-        if_contains_word('game', 'gaming', 'gamer'),
-        lambda update: '<video>gaming.mp4'
-    ),
-    # Messages mentioning history or Japan.
-    (
-        if_contains_word('history', 'historical', 'ming', 'qing', 'anime', 'japan'),
-        random_response([
-            (lambda update: '<noresponse>', 0.75),
-            (lambda update: '<video>historical.mp4', 0.125),
-            (lambda update: '<video>historical_2.mp4', 0.125)
-        ])
-    ),
-    (
-        if_contains_word('friend', 'friends'),
-        lambda update: '<video>friends.mp4'
-    ),
-    # Messages mentioning hamburgers or steamed hams.
-    (
-        logical_or(
-            if_contains_word('hamburger', 'cheeseburger'),
-            if_contains('steamed ham')
-        ),
-        lambda update: '<video>Steamed Hams.mp4'
-    ),
-    # Randomly send images of mao zedong and the social credit/malice notices.
-    (
-        lambda _: True,
-        random_response([
-            (lambda update: '<noresponse>', 1),
-            (zedong_of_the_day, 0.05),
-            (social_credit_notice, 0.001),
-            (malice_notice, 0.0025)
-        ])
+# Named functions and conditions that can be referenced from response_rules.json.
+response_functions = {
+    'zedong_of_the_day':    zedong_of_the_day,
+    'social_credit_notice': social_credit_notice,
+    'malice_notice':        malice_notice,
+    'bing_chilling_notice': bing_chilling_notice
+}
+
+response_conditions = {
+    'may_post_daily_zedong': may_post_daily_zedong,
+    'negative_reputation':   lambda update: get_reputation(update) < 0
+}
+
+
+# Returns a function that picks a random element if value is a list, and always returns value otherwise.
+def choice_of(value):
+    if isinstance(value, list): return lambda: random.choice(value)
+    else: return lambda: value
+
+
+# Weight of an entry of a random response. If the entry has a condition, the weight is zero while it doesn't hold.
+def weight_from_spec(spec):
+    weight = spec['weight']
+    if 'if' not in spec: return weight
+
+    if spec['if'] not in response_conditions: raise ValueError(f'Unknown response condition {spec["if"]}.')
+    condition = response_conditions[spec['if']]
+
+    return lambda update: weight if condition(update) else 0.0
+
+
+# Builds a response from its declarative form, e.g. { "change_score": [25, 50], "then": { "video": "patriot.mp4" } }.
+# cause is recorded in the reputation history for score changes made by the response.
+def response_from_spec(spec, cause = 'response'):
+    if not isinstance(spec, dict): raise ValueError(f'A response must be an object, got {spec!r}.')
+    then = response_from_spec(spec['then'], cause) if 'then' in spec else None
+
+    if 'change_score' in spec:
+        a, b = spec['change_score']
+        return change_score(a, b, wrapped = then, cause = cause)
+
+    if 'change_score_on_sentiment' in spec:
+        a, b = spec['change_score_on_sentiment']
+        return change_score_on_sentiment(a, b, spec['threshold'], wrapped = then, cause = cause)
+
+    if 'maybe' in spec:
+        if then is None: raise ValueError('A maybe response requires a then response.')
+        return maybe_respond(then, spec['maybe'])
+
+    if 'random' in spec:
+        return random_response([(response_from_spec(entry['response'], cause), weight_from_spec(entry)) for entry in spec['random']])
+
+    if 'function' in spec:
+        if spec['function'] not in response_functions: raise ValueError(f'Unknown response function {spec["function"]}.')
+        return response_functions[spec['function']]
+
+    if 'no_response' in spec:
+        return lambda update: '<noresponse>'
+
+    if 'text_file' in spec:
+        choose_file = choice_of(spec['text_file'])
+        return lambda update: read_text(choose_file())
+
+    for media_type in ['image', 'video', 'audio']:
+        if media_type in spec:
+            tag, choose_file = f'<{media_type}>', choice_of(spec[media_type])
+            return lambda update: tag + choose_file()
+
+    if 'text' in spec:
+        text = spec['text']
+        return lambda update: text
+
+    raise ValueError(f'Unknown response {spec!r}.')
+
+
+# Compiles the rules in the given file. The keywords of all matchers are found in a single pass, after which the
+# matchers are evaluated against the resulting hit set in the order in which they appear in the file.
+# Raises a ValueError if a rule references a file that doesn't exist.
+def load_response_rules(file_path):
+    with open(file_path, 'r', encoding = 'utf-8') as handle:
+        rules = json.load(handle)
+
+    problems = asset_files.problems(dict.fromkeys(asset for rule in rules for asset in spec_assets(rule['response'])))
+    if problems: raise ValueError(f'Invalid assets in {file_path}: {" ".join(problems)}')
+
+    names = [rule.get('name', str(index)) for index, rule in enumerate(rules)]
+
+    return compiled_matchers(
+        [(matcher_from_spec(rule['match']), response_from_spec(rule['response'], f'rule:{name}')) for rule, name in zip(rules, names)],
+        names
     )
-]
 
 
+# (media type, file name) of every file a response in the spec can send, where text files have the type 'text'.
+def spec_assets(spec):
+    if isinstance(spec, list):
+        for entry in spec: yield from spec_assets(entry)
+        return
+
+    if not isinstance(spec, dict): return
+
+    for media_type in ['image', 'video', 'audio']:
+        if media_type in spec:
+            for file_name in spec[media_type] if isinstance(spec[media_type], list) else [spec[media_type]]:
+                yield media_type, file_name
+
+    if 'text_file' in spec:
+        for file_name in spec['text_file'] if isinstance(spec['text_file'], list) else [spec['text_file']]:
+            yield 'text', file_name
+
+    for key in ['then', 'response', 'random']:
+        if key in spec: yield from spec_assets(spec[key])
+
+
+# (media type, file name) of every file referenced by the rules in the given file, without duplicates.
+def referenced_assets(file_path):
+    with open(file_path, 'r', encoding = 'utf-8') as handle:
+        rules = json.load(handle)
+
+    return list(dict.fromkeys(asset for rule in rules for asset in spec_assets(rule['response'])))
+
+
+response_rules_path   = path.join(asset_folder, 'response_rules.json')
+compiled_response_map = load_response_rules(response_rules_path)
+
+
+# Swaps the rules used by process_message for the current contents of the rule file.
+# If the file is invalid the current rules stay in place.
+def reload_response_rules(file_path = response_rules_path):
+    global compiled_response_map
+
+    start = time.perf_counter()
+
+    try: rules = load_response_rules(file_path)
+    except Exception as e:
+        print(f'Failed to reload response rules from {file_path}, keeping the current rules: {e}')
+        return
+
+    compiled_response_map = rules
+    print(f'Reloaded {len(rules.rules)} response rules in {(time.perf_counter() - start) * 1000:.1f} ms.')
+
+
+def watch_response_rules():
+    watch_file(response_rules_path, reload_response_rules)
+
+
+# Evaluates the rules against the message and runs the response of the first match.
+# The time spent on every step is recorded in the rule profiler (see /rule_stats).
 def process_message(update):
-    message = normalize_message(update.message.text)
+    rules   = compiled_response_map
+    message = get_message_context(update.message).normalized_text
+
+    start   = time.perf_counter_ns()
+    hits    = rules.scan(message)
+    samples = [('(keyword scan)', False, time.perf_counter_ns() - start, 0)]
+
+    matches = []
+    index   = rules.match_index(message, hits, matches)
+    samples.extend((rules.names[i], matched, elapsed, 0) for i, matched, elapsed in matches)
 
-    for matcher, response in response_map:
-        if matcher(message): return response(update)
+    result = None
+    if index is not None:
+        start  = time.perf_counter_ns()
+        result = rules.rules[index][1](update)
 
-    return None
+        name, matched, elapsed, _ = samples[-1]
+        samples[-1] = (name, matched, elapsed, time.perf_counter_ns() - start)
 
+    profiler.record(samples)
+    return result
 
 
 def respond(updater, update, context):
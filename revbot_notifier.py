@@ -7,7 +7,7 @@ from _thread import start_new_thread
 from threading import Lock
 
 from common import send_image_message
-from responses import normalize_message
+from text_normalization import normalize_message
 
 address = ('localhost', 1420)
 
@@ -0,0 +1,59 @@
+import time
+from threading import Lock
+
+
+# Counts how often every response rule is evaluated and matches, and how much time is spent in its matcher and
+# response. The samples of a message are collected by the caller and merged here under a single lock acquisition,
+# so this is cheap enough to leave enabled all the time.
+class rule_profiler:
+    def __init__(self):
+        self.lock = Lock()
+        self.reset()
+
+
+    def reset(self):
+        with self.lock:
+            self.stats    = dict() # rule name => [evaluations, hits, matcher ns, response ns]
+            self.messages = 0
+            self.since    = time.time()
+
+
+    # samples: list of (rule name, matched, matcher ns, response ns).
+    def record(self, samples):
+        with self.lock:
+            self.messages += 1
+
+            for name, matched, matcher_ns, response_ns in samples:
+                entry = self.stats.get(name)
+                if entry is None: entry = self.stats[name] = [0, 0, 0, 0]
+
+                entry[0] += 1
+                entry[1] += matched
+                entry[2] += matcher_ns
+                entry[3] += response_ns
+
+
+    # Human readable summary with the most expensive rules first.
+    def report(self, limit = 40):
+        with self.lock:
+            stats    = sorted(self.stats.items(), key = lambda kv: kv[1][2] + kv[1][3], reverse = True)
+            messages = self.messages
+            since    = self.since
+
+        if messages == 0: return 'No messages have been processed since the statistics were last reset.'
+
+        total_ns = sum(entry[2] + entry[3] for _, entry in stats)
+        hours    = (time.time() - since) / 3600
+
+        lines = [
+            f'{messages} messages in {hours:.1f} h, {total_ns / 1e6:.1f} ms total, {total_ns / messages / 1e3:.1f} us/message.',
+            'rule: evaluations / hits / matcher ms / response ms'
+        ]
+
+        for name, (evaluations, hits, matcher_ns, response_ns) in stats[:limit]:
+            lines.append(f'{name}: {evaluations} / {hits} / {matcher_ns / 1e6:.2f} / {response_ns / 1e6:.2f}')
+
+        return '\n'.join(lines)
+
+
+profiler = rule_profiler()
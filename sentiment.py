@@ -0,0 +1,83 @@
+# Small lexicon based polarity scorer, modelled after TextBlob's default (pattern) analyzer:
+# the polarity of a message is the average polarity of the sentiment words in it, where intensifiers ('very good')
+# scale the next sentiment word and negations ('not good') flip and dampen it.
+# Expects normalized messages (see text_normalization), so contractions appear without apostrophes ('dont').
+
+from array import array
+from os import path
+
+from common import asset_folder
+
+
+lexicon_path = path.join(asset_folder, 'sentiment_lexicon.tsv')
+
+intensifiers = {
+    'very': 1.3, 'really': 1.3, 'so': 1.3, 'too': 1.3, 'extremely': 1.5, 'incredibly': 1.5, 'super': 1.4,
+    'totally': 1.3, 'absolutely': 1.5, 'most': 1.3, 'more': 1.2, 'quite': 1.1, 'pretty': 1.1,
+    'somewhat': 0.8, 'slightly': 0.7, 'kinda': 0.8, 'barely': 0.6, 'less': 0.7
+}
+
+negations = {
+    'not', 'no', 'never', 'nothing', 'neither', 'nor', 'hardly', 'without', 'cannot',
+    'dont', 'doesnt', 'didnt', 'isnt', 'arent', 'wasnt', 'werent', 'cant', 'couldnt', 'wont', 'wouldnt', 'shouldnt', 'aint'
+}
+
+# Same factor TextBlob applies to negated words.
+negation_factor = -0.5
+
+
+def load_lexicon(file_path):
+    lexicon = dict()
+
+    with open(file_path, 'r', encoding = 'utf-8') as handle:
+        for line in handle:
+            if line.startswith('#') or not line.strip(): continue
+
+            word, polarity = line.split('\t')
+            lexicon[word] = float(polarity)
+
+    return lexicon
+
+
+# Loaded on the first call to polarity rather than at import, to keep it out of startup.
+lexicon = None
+
+
+# Polarity of a single normalized message between -1.0 and 1.0, 0.0 if it contains no sentiment words.
+def polarity(text):
+    global lexicon
+    if lexicon is None: lexicon = load_lexicon(lexicon_path)
+
+    words    = text.split()
+    total    = 0.0
+    count    = 0
+    modifier = 1.0
+
+    for index, word in enumerate(words):
+        following = words[index + 1] if index + 1 < len(words) else None
+
+        if word in negations:
+            modifier *= negation_factor
+            continue
+
+        # Words like 'pretty' are intensifiers in front of another sentiment word and sentiment words otherwise.
+        if word in intensifiers and (following in lexicon or following in intensifiers):
+            modifier *= intensifiers[word]
+            continue
+
+        value = lexicon.get(word)
+
+        if value is not None:
+            total   += max(-1.0, min(1.0, value * modifier))
+            count   += 1
+            modifier = 1.0
+        # Like TextBlob, single letter words ('not a good idea') don't break up a negation.
+        elif len(word) > 1:
+            modifier = 1.0
+
+    return max(-1.0, min(1.0, total / count)) if count > 0 else 0.0
+
+
+# Polarity of every message in texts, as an array of doubles.
+def polarity_batch(texts):
+    return array('d', map(polarity, texts))
@@ -4,9 +4,7 @@ import sys
 
 interp   = str(sys.executable)
 commands = [
-    '-m pip install python-telegram-bot==13.11',
-    '-m pip install textblob',
-    '-m textblob.download_corpora'
+    '-m pip install python-telegram-bot==13.11'
 ]
 
 
@@ -0,0 +1,78 @@
+# Reports where the time goes when the bot starts. Enabled by running main.py with --profile-startup,
+# in which case every module import and every initialization stage is timed and a breakdown is printed
+# instead of starting to poll.
+# Must be imported before anything else in main.py so it sees all imports.
+
+import builtins
+import sys
+import time
+from contextlib import contextmanager
+
+
+enabled       = '--profile-startup' in sys.argv
+process_start = time.perf_counter()
+
+import_times = dict() # module name => [total seconds, self seconds (excluding nested imports)]
+import_stack = []     # time spent in nested imports for every import in progress
+stage_times  = []     # (stage name, seconds)
+
+original_import = builtins.__import__
+
+
+def timed_import(name, globals = None, locals = None, fromlist = (), level = 0):
+    # Relative and already imported modules are cheap, don't bother timing those.
+    if level != 0 or name in sys.modules:
+        return original_import(name, globals, locals, fromlist, level)
+
+    import_stack.append(0.0)
+    start = time.perf_counter()
+
+    try:
+        return original_import(name, globals, locals, fromlist, level)
+    finally:
+        elapsed = time.perf_counter() - start
+        nested  = import_stack.pop()
+
+        if import_stack: import_stack[-1] += elapsed
+        import_times[name] = [elapsed, elapsed - nested]
+
+
+if enabled: builtins.__import__ = timed_import
+
+
+# Records the time since the previous mark (or since this module was imported) as a stage.
+last_mark = process_start
+
+
+def mark(name):
+    global last_mark
+
+    now = time.perf_counter()
+    stage_times.append((name, now - last_mark))
+    last_mark = now
+
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try: yield
+    finally:
+        global last_mark
+        last_mark = time.perf_counter()
+        stage_times.append((name, last_mark - start))
+
+
+def report(limit = 25):
+    total = time.perf_counter() - process_start
+
+    print(f'Startup took {total * 1000:.1f} ms (excluding interpreter startup).')
+
+    print('\nInitialization stages:')
+    for name, elapsed in stage_times:
+        print(f'  {name:<48}{elapsed * 1000:>10.1f} ms')
+
+    print(f'\nSlowest imports (self / including nested imports), {len(import_times)} modules in total:')
+    slowest = sorted(import_times.items(), key = lambda kv: kv[1][1], reverse = True)[:limit]
+    for name, (inclusive, exclusive) in slowest:
+        print(f'  {name:<48}{exclusive * 1000:>10.1f} ms {inclusive * 1000:>10.1f} ms')
+
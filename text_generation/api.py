@@ -1,8 +1,12 @@
 import json
 import copy
+import random
 import re
+import threading
+import time
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from common import clamp
 
@@ -35,6 +39,152 @@ class GenerationError(Exception):
     pass
 
 
+class CircuitBreaker:
+    """
+    Stops sending requests to the backend after failure_threshold consecutive failures, so that while it is down every
+    generation fails right away instead of waiting for timeouts. After reset_timeout seconds a single request is let
+    through again, which closes the breaker if it succeeds and opens it for another reset_timeout if it doesn't.
+    """
+
+    def __init__(self, failure_threshold = 5, reset_timeout = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout     = reset_timeout
+        self.failures          = 0
+        self.opened_at         = None
+        self.probing           = False
+        self.lock              = threading.Lock()
+
+
+    def allow_request(self):
+        with self.lock:
+            if self.opened_at is None: return True
+            if self.probing or time.monotonic() - self.opened_at < self.reset_timeout: return False
+
+            self.probing = True
+            return True
+
+
+    def record_success(self):
+        with self.lock:
+            self.failures  = 0
+            self.opened_at = None
+            self.probing   = False
+
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probing   = False
+
+            if self.failures >= self.failure_threshold or self.opened_at is not None:
+                self.opened_at = time.monotonic()
+
+
+class GenerationClient:
+    """
+    Keep-alive connection pool to the generation backend, shared by every chatbot of a ChatBotAPI.
+    Requests time out, connection errors and overload responses are retried a bounded number of times with jittered
+    exponential backoff, and the whole thing sits behind a CircuitBreaker. Every failure surfaces as a GenerationError.
+    """
+
+    retry_statuses = { 429, 502, 503, 504 }
+
+    def __init__(self, connect_timeout = 3.05, read_timeout = 120.0, max_retries = 2, backoff = 0.5, pool_size = 4,
+                 failure_threshold = 5, reset_timeout = 30.0):
+        self.timeout     = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff     = backoff
+        self.breaker     = CircuitBreaker(failure_threshold, reset_timeout)
+
+        self.session = requests.Session()
+        adapter      = HTTPAdapter(pool_connections = 1, pool_maxsize = pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+
+    def post_json(self, url, payload, headers = None):
+        """
+        Posts payload as JSON and returns the decoded response. Responses with other error statuses (such as the input
+        validation errors of TGI) are returned as well, since their body describes the error.
+        """
+        return self._decode(self._post(url, payload, headers))
+
+
+    def stream_json(self, url, payload, headers = None):
+        """
+        Posts payload as JSON and yields the JSON encoded server-sent events of the response as they arrive.
+        A response that isn't an event stream (such as an input validation error) is yielded as a single event.
+        """
+        response = self._post(url, payload, headers, stream = True)
+
+        with response:
+            if not response.headers.get("Content-Type", "").startswith("text/event-stream"):
+                yield self._decode(response)
+                return
+
+            self.breaker.record_success()
+
+            try:
+                for line in response.iter_lines(decode_unicode = True):
+                    if line and line.startswith("data:"): yield json.loads(line[len("data:"):])
+            except (requests.exceptions.RequestException, ValueError) as e:
+                self._fail(e)
+
+
+    def _decode(self, response):
+        try: result = response.json()
+        except (requests.exceptions.RequestException, ValueError): self._fail(f"invalid response (HTTP {response.status_code})")
+
+        self.breaker.record_success()
+        return result
+
+
+    def _post(self, url, payload, headers, stream = False):
+        """
+        Sends the request, retrying connection errors and overload responses. Returns the response once the backend
+        answered, the caller decides whether the request succeeded.
+        """
+        if not self.breaker.allow_request(): raise GenerationError("Generation Error: the backend is unavailable.")
+
+        try:
+            for attempt in range(self.max_retries + 1):
+                if attempt > 0: time.sleep(random.uniform(0, self.backoff * 2 ** (attempt - 1)))
+
+                try:
+                    response = self.session.post(url, json = payload, headers = headers, timeout = self.timeout, stream = stream)
+                except requests.exceptions.ReadTimeout as e:
+                    # The backend is busy generating, sending the same request again would only add to its load.
+                    self._fail(e)
+                except requests.exceptions.RequestException as e:
+                    error = e
+                    continue
+
+                if response.status_code in self.retry_statuses or response.status_code >= 500:
+                    error = f"HTTP {response.status_code}"
+                    response.close()
+                    continue
+
+                return response
+        except GenerationError:
+            raise
+        except BaseException:
+            # Anything else (even a KeyboardInterrupt) still has to settle the request, or a probe of an open breaker
+            # would never finish and the breaker would stay open for good.
+            self.breaker.record_failure()
+            raise
+
+        self._fail(error)
+
+
+    def _fail(self, error):
+        self.breaker.record_failure()
+        raise GenerationError(f"Generation Error: {error}")
+
+
+    def close(self):
+        self.session.close()
+
+
 class GenerationBase:
     def __init__(self):
         self.params = copy.deepcopy(base_params)
@@ -52,7 +202,19 @@ class GenerationBase:
 
 
 class ChatBot(GenerationBase):
-    def __init__(self, bot_name, context, url, headers = None, format = "dolphin", messages = None, start_messages = None):
+    message_formats = {
+        'dolphin': '<|im_start|>{name}\n{content}<|im_end|>',
+        'llama':   '<s>{name}: {content}</s>',
+        'default': '{name}: {content}'
+    }
+
+    message_prepend = {
+        'dolphin': '<|im_start|>',
+        'llama':   '<s>',
+        'default': ''
+    }
+
+    def __init__(self, bot_name, context, url, headers = None, format = "dolphin", messages = None, start_messages = None, client = None):
         super().__init__()
 
         self.bot_name        = bot_name
@@ -61,10 +223,24 @@ class ChatBot(GenerationBase):
         self.start_messages  = start_messages if start_messages is not None else []
         self.url             = url
         self.generate_url    = f"{url}/tgi/generate" if headers is not None else f"{url}/generate"
+        self.stream_url      = f"{url}/tgi/generate_stream" if headers is not None else f"{url}/generate_stream"
         self.headers         = headers
+        self.client          = client if client is not None else GenerationClient()
         self.format          = format
         self.functions       = []
+        self.function_regex  = None
         self.message_headers = []
+        self.token_counter   = None
+        self.context_window  = None
+
+        # The prompt is the prefix (the context and the start messages), the history and the suffix that starts the
+        # response. Each message is only formatted (and its tokens counted) once, when it is added, and the prefix only
+        # changes with the start messages, so every prompt starts with the same bytes and the backend can reuse the
+        # work it did for them.
+        self.history       = [] # [formatted line, token count or None] for every message in self.messages
+        self.prefix        = None
+        self.prefix_tokens = None
+        self.suffix        = f'{self.message_prepend.get(self.format, self.message_prepend["default"])}{self.bot_name}\n'
 
 
     def define_function(self, match, handler):
@@ -72,7 +248,10 @@ class ChatBot(GenerationBase):
         Defines a function that can be invoked by the bot when it produces text matching the given regex.
         Handler should be invocable as f(match, response_text, telegram_update) -> None
         """
-        self.functions.append((match, handler))
+        self.functions.append((re.compile(match), handler))
+
+        # Only used to remove every function call from the response in a single pass.
+        self.function_regex = re.compile('|'.join(f'(?:{pattern.pattern})' for pattern, _ in self.functions))
 
 
     def define_message_header_function(self, handler):
@@ -83,23 +262,41 @@ class ChatBot(GenerationBase):
         self.message_headers.append(handler)
 
 
-    def generate_response(self, username, message, update, max_new_tokens = None, can_run_functions = True):
+    def set_token_budget(self, token_counter, context_window):
+        """
+        Trims the history before every request so the prompt and the response fit in context_window tokens, as counted
+        by token_counter. Without a budget the history is only trimmed when the backend rejects the prompt.
+        """
+        self.token_counter  = token_counter
+        self.context_window = context_window
+        self.prefix_tokens  = None
+
+        for line in self.history: line[1] = None
+
+
+    def generate_response(self, username, message, update, max_new_tokens = None, can_run_functions = True, on_text = None):
+        """
+        If on_text is given the response is streamed, and on_text is called with the text generated so far (without
+        function calls) whenever a token arrives. Functions are run on the complete response, as usual.
+        """
         for handler in self.message_headers:
             self.send_system_message(handler(update))
 
         self._append_message(username, message)
 
 
-        request_params = copy.deepcopy(self.params)
+        # Only the parameters themselves are changed per request, the values are shared.
+        request_params = { "inputs": "", "parameters": dict(self.params["parameters"]) }
         if max_new_tokens is not None: request_params["parameters"]["max_new_tokens"] = max_new_tokens
 
+        # TGI refuses to stream the details of the input tokens.
+        if on_text is not None: request_params["parameters"]["decoder_input_details"] = False
 
-        while True:
-            formatted_messages = self._format_messages(self.start_messages)
-            formatted_messages.extend(self._format_messages(self.messages))
+        self._fit_history(request_params["parameters"]["max_new_tokens"])
 
-            request_params["inputs"] = self._make_prompt(formatted_messages)
-            result_json              = requests.post(self.generate_url, json = request_params, headers = self.headers).json()
+        while True:
+            request_params["inputs"] = self._make_prompt()
+            result_json              = self._request(request_params, on_text)
             error                    = result_json.get("error")
 
 
@@ -107,83 +304,156 @@ class ChatBot(GenerationBase):
                 result_text = result_json.get("generated_text")
                 self._append_message(self.bot_name, result_text)
 
-                if can_run_functions:
-                    # Run twice so we can call handlers with unprocessed text.
+                if can_run_functions and self.function_regex is not None:
+                    # Call the handlers with the unprocessed text before removing the function calls from it.
+                    # Every pattern is searched on its own, so one pattern can't swallow the calls of another.
                     for pattern, handler in self.functions:
-                        matches = re.findall(pattern, result_text)
-                        for match in matches: handler(match, result_text, update)
+                        for match in pattern.finditer(result_text): handler(match, result_text, update)
 
-                    for pattern, handler in self.functions:
-                        result_text = re.sub(pattern, '', result_text)
+                    result_text = self.function_regex.sub('', result_text)
 
                 return result_text
             else:
                 # Input validation error is returned if the input contains too many tokens
                 # so just forget the least recent item in our history.
-                if error.startswith("Input validation error: `inputs`"): self.messages.pop(0)
+                # With a token budget this only happens if the count was off.
+                if error.startswith("Input validation error: `inputs`") and self.messages: self._forget_messages(1)
                 else: raise GenerationError(f"Generation Error: {error}")
 
 
+    def _request(self, request_params, on_text):
+        if on_text is None: return self.client.post_json(self.generate_url, request_params, self.headers)
+
+        text = ""
+
+        for event in self.client.stream_json(self.stream_url, request_params, self.headers):
+            # The last event carries the complete text, as the non-streaming endpoint would return it.
+            if event.get("error") or event.get("generated_text") is not None: return event
+
+            token = event.get("token") or {}
+            if token.get("special") or not token.get("text"): continue
+
+            text += token["text"]
+            on_text(self._visible_text(text))
+
+        raise GenerationError("Generation Error: the response ended before the generation finished.")
+
+
+    def _visible_text(self, text):
+        """
+        Text generated so far without function calls, including one that has only been partially generated.
+        """
+        if self.function_regex is not None: text = self.function_regex.sub('', text)
+
+        start = text.rfind('{')
+        if start != -1 and '}' not in text[start:]: text = text[:start]
+
+        return text
+
+
+    def _fit_history(self, max_new_tokens):
+        """
+        Forgets the oldest messages that don't fit in the context window next to the context, the start messages and
+        the response, newest first. The newest message is always kept.
+        """
+        if self.token_counter is None: return
+
+        count = self.token_counter.count
+
+        if self.prefix_tokens is None: self.prefix_tokens = count(self._prompt_prefix() + self.suffix)
+
+        budget = self.context_window - max_new_tokens - self.prefix_tokens
+        kept   = 0
+
+        for line in reversed(self._history()):
+            if line[1] is None: line[1] = count(line[0])
+
+            budget -= line[1]
+            if budget < 0 and kept > 0: break
+
+            kept += 1
+
+        self._forget_messages(len(self.messages) - kept)
+
+
     def send_system_message(self, message:str):
-        self.messages.append({"name": "system", "content": message})
+        self._append_message("system", message)
 
 
     def clear_history(self):
         self.messages.clear()
+        self.history.clear()
 
 
-    def _format_messages(self, messages):
-        message_formats = {
-            'dolphin': '<|im_start|>{name}\n{content}<|im_end|>',
-            'llama':   '<s>{name}: {content}</s>',
-            'default': '{name}: {content}'
-        }
-
-        format_string = message_formats[self.format] if self.format in message_formats else message_formats['default']
+    def _format_message(self, message):
+        format_string = self.message_formats.get(self.format, self.message_formats['default'])
+        return format_string.format(name = message['name'], content = message['content'])
 
 
-        return list(map(
-            lambda message: format_string.format(name = message['name'], content = message['content']),
-            messages
-        ))
+    def _format_messages(self, messages):
+        return [self._format_message(message) for message in messages]
 
 
     def _append_message(self, name: str, content: str):
-        self.messages.append({"name": name, "content": content})
+        message = {"name": name, "content": content}
+
+        self._history().append([self._format_message(message) + '\n', None])
+        self.messages.append(message)
 
 
     def _append_start_message(self, name: str, content: str):
         self.start_messages.append({"name": name, "content": content})
 
+        self.prefix        = None
+        self.prefix_tokens = None
 
-    def _make_prompt(self, messages: list):
-        message_prepend = {
-            'dolphin': '<|im_start|>',
-            'llama':   '<s>',
-            'default': ''
-        }
 
-        prepend = message_prepend[self.format] if self.format in message_prepend else message_prepend['default']
-        history = '\n'.join(messages)
+    def _forget_messages(self, count: int):
+        del self._history()[:count]
+        del self.messages[:count]
 
-        return f'{self.context}\n{history}\n{prepend}{self.bot_name}\n'
+
+    def _history(self):
+        """
+        The formatted lines of the messages, formatting them again if the messages were changed from outside.
+        """
+        if len(self.history) != len(self.messages):
+            self.history = [[line + '\n', None] for line in self._format_messages(self.messages)]
+
+        return self.history
+
+
+    def _prompt_prefix(self):
+        if self.prefix is None:
+            self.prefix = f'{self.context}\n' + ''.join(line + '\n' for line in self._format_messages(self.start_messages))
+
+        return self.prefix
+
+
+    def _make_prompt(self):
+        return self._prompt_prefix() + ''.join(line for line, _ in self._history()) + self.suffix
 
 
 class ChatBotAPI:
-    def __init__(self, url, username = None, api_key = None):
+    def __init__(self, url, username = None, api_key = None, **client_options):
+        """
+        client_options are passed on to GenerationClient (timeouts, retries and circuit breaker settings), so they can be
+        set in api_auth.json next to the url.
+        """
         self.url     = url
         self.headers = {}
+        self.client  = GenerationClient(**client_options)
 
         if username is not None: self.headers["Username"] = username
         if api_key  is not None: self.headers["API-KEY"]  = api_key
 
 
     def create_chatbot(self, bot_name, context, format = "dolphin", messages = None):
-        return ChatBot(bot_name, context, self.url, self.headers, format, messages)
+        return ChatBot(bot_name, context, self.url, self.headers, format, messages, client = self.client)
 
 
     def load_chatbot(self, file_path: str):
         if not file_path.endswith(".json"): file_path += ".json"
 
         bot_data = json.load(open(file_path, "r"))
-        return ChatBot(url=self.url, headers=self.headers, **bot_data)
\ No newline at end of file
+        return ChatBot(url=self.url, headers=self.headers, client=self.client, **bot_data)
\ No newline at end of file
@@ -1,5 +1,6 @@
 from reputation import update_reputation
 from text_generation.api import ChatBotAPI
+from text_generation.token_counter import TokenCounter
 
 from responses import get_reputation
 from common import asset_folder, config, api_auth_config, clamp
@@ -19,12 +20,19 @@ class ChatbotFactory:
         self.api       = ChatBotAPI(**api_auth_config)
         self.instances = {}
 
+        # The history is trimmed locally to fit 'context_window' (the max_total_tokens of the backend), counting
+        # tokens with the model's tokenizer.json at 'tokenizer_path' (relative to the asset folder) if there is one.
+        if 'context_window' in config:
+            tokenizer_path     = f'{asset_folder}/{config["tokenizer_path"]}' if 'tokenizer_path' in config else None
+            self.token_counter = TokenCounter(tokenizer_path)
+
 
     def create_chatbot(self, personality, functions = (), message_headers = ()):
         if not hasattr(self, 'api'): raise RuntimeError('Text generation is not enabled.')
 
         bot = self.api.load_chatbot(f'{asset_folder}/personality.{personality}.json')
         bot.set_params(temperature = config['temperature'], max_new_tokens = config['max_new_tokens'])
+        if 'context_window' in config: bot.set_token_budget(self.token_counter, config['context_window'])
 
         for pattern, handler in functions:
             bot.define_function(pattern, handler)
@@ -51,13 +59,13 @@ def get_xi_jinping_chatbot():
         try: value = int(match.group(1))
         except: return
 
-        update_reputation(+clamp(abs(value), 0, 100), update)
+        update_reputation(+clamp(abs(value), 0, 100), update, 'chatbot_grant')
 
     def deduct_social_credit(match, response, update):
         try: value = int(match.group(1))
         except: return
 
-        update_reputation(-clamp(abs(value), 0, 100), update)
+        update_reputation(-clamp(abs(value), 0, 100), update, 'chatbot_deduct')
 
     def describe_user(update):
         return f'{update.message.from_user.full_name} currently has {str(get_reputation(update))} social credits.'
@@ -66,8 +74,8 @@ def get_xi_jinping_chatbot():
     return chatbot_factory.create_or_get_chatbot(
         'xi_jinping',
         [
-            ("{grant_social_credit:(.+)}", grant_social_credit),
-            ("{deduct_social_credit:(.+)}", deduct_social_credit)
+            ("{grant_social_credit:([^}]+)}", grant_social_credit),
+            ("{deduct_social_credit:([^}]+)}", deduct_social_credit)
         ],
         [ describe_user ]
     )
\ No newline at end of file
@@ -0,0 +1,102 @@
+"""
+Minimal stand-in for a text-generation-inference server, for trying the bot's generation client locally without a GPU.
+Answers POST /generate and /generate_stream (and their /tgi/ variants) with a canned reply, and can be made slow or
+unreliable to see how the client's timeouts, retries, circuit breaker and streaming behave.
+
+Usage: python -m text_generation.stub_server [--port 8080] [--delay SECONDS] [--token-delay SECONDS]
+                                             [--failure-rate 0.0-1.0] [--down] [--max-total-tokens N]
+Then point assets/api_auth.json at it: { "url": "http://127.0.0.1:8080" }
+"""
+
+import argparse
+import json
+import random
+import re
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so the connection reuse of the client can be observed in the log.
+    protocol_version = "HTTP/1.1"
+
+    options = None
+
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        path = self.path.removeprefix("/tgi")
+
+        if path not in ("/generate", "/generate_stream"):
+            return self.reply(404, {"error": f"Unknown path {self.path}"})
+
+        if self.options.down or random.random() < self.options.failure_rate:
+            return self.reply(503, {"error": "Model is overloaded", "error_type": "overloaded"})
+
+        time.sleep(self.options.delay)
+
+        request = json.loads(body)
+        inputs  = request.get("inputs", "")
+
+        # Tokens counted as four bytes each, roughly what a real tokenizer does with English text.
+        total_tokens = len(inputs.encode("utf-8")) // 4 + request.get("parameters", {}).get("max_new_tokens", 0)
+        if self.options.max_total_tokens and total_tokens > self.options.max_total_tokens:
+            message = f"Input validation error: `inputs` tokens + `max_new_tokens` must be <= {self.options.max_total_tokens}. Given: {total_tokens}"
+            return self.reply(422, {"error": message, "error_type": "validation"})
+        text   = f"The Party has received your {len(inputs)} characters. {{grant_social_credit:5}}"
+
+        if path == "/generate": self.reply(200, {"generated_text": text})
+        else: self.stream(text)
+
+
+    # Sends the text word by word as server-sent events, in the format of TGI.
+    def stream(self, text):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        tokens = re.findall(r"\S+\s*", text)
+
+        for index, token in enumerate(tokens):
+            time.sleep(self.options.token_delay)
+
+            last  = index == len(tokens) - 1
+            event = {"token": {"id": index, "text": token, "logprob": 0.0, "special": False}, "generated_text": text if last else None, "details": None}
+            data  = f"data:{json.dumps(event)}\n\n".encode("utf-8")
+
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        self.wfile.write(b"0\r\n\r\n")
+
+
+    def reply(self, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+    def log_message(self, format, *args):
+        print(f"[Stub TGI] {self.client_address[1]} {format % args}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Stub text-generation-inference server.")
+    parser.add_argument("--port", type = int, default = 8080)
+    parser.add_argument("--delay", type = float, default = 0.0, help = "Seconds to wait before answering.")
+    parser.add_argument("--token-delay", type = float, default = 0.1, help = "Seconds between streamed tokens.")
+    parser.add_argument("--failure-rate", type = float, default = 0.0, help = "Fraction of requests answered with 503.")
+    parser.add_argument("--max-total-tokens", type = int, default = 0, help = "Reject longer prompts, like TGI's --max-total-tokens.")
+    parser.add_argument("--down", action = "store_true", help = "Answer every request with 503.")
+
+    StubHandler.options = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", StubHandler.options.port), StubHandler)
+    print(f"[Stub TGI] Listening on http://127.0.0.1:{StubHandler.options.port}")
+    server.serve_forever()
@@ -0,0 +1,36 @@
+import math
+import os
+
+
+class TokenCounter:
+    """
+    Counts the tokens of a prompt locally, so the history can be trimmed to fit the context window before it is sent
+    instead of after the backend rejects it.
+    Uses the model's tokenizer.json (through the tokenizers package) when it is available. Otherwise the count is
+    estimated from the length of the UTF-8 encoded text, erring on the high side: English text averages around four
+    bytes per token and CJK text around three.
+    """
+
+    bytes_per_token = 3.0
+
+    def __init__(self, tokenizer_path = None):
+        self.tokenizer = None
+
+        if tokenizer_path is None: return
+
+        if not os.path.exists(tokenizer_path):
+            print(f"Tokenizer {tokenizer_path} does not exist, token counts will be estimated.")
+            return
+
+        try:
+            from tokenizers import Tokenizer
+            self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        except ImportError:
+            print("The tokenizers package is not installed, token counts will be estimated.")
+        except Exception as e:
+            print(f"Failed to load tokenizer {tokenizer_path}, token counts will be estimated: {e}")
+
+
+    def count(self, text: str):
+        if self.tokenizer is not None: return len(self.tokenizer.encode(text, add_special_tokens = False).ids)
+        return math.ceil(len(text.encode("utf-8")) / self.bytes_per_token)
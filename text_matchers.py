@@ -1,11 +1,15 @@
-from textblob import TextBlob
-
 from common import *
+from keyword_automaton import keyword_automaton
+from sentiment import polarity
 
+import functools
 import re
+import time
 
 
 # Helper classes for mapping inputs to responses.
+# Every matcher can be called with a string directly, or evaluated through evaluate(string, hits) against the keyword
+# hits produced by a compiled_matchers automaton, which avoids rescanning the string once per keyword.
 class if_contains:
     def __init__(self, *strings):
         self.strings = list(strings)
@@ -13,13 +17,28 @@ class if_contains:
     def __call__(self, string):
         return any([search_string in string for search_string in self.strings])
 
+    def evaluate(self, string, hits):
+        return any(hits.contains(search_string) for search_string in self.strings)
+
+    def keywords(self):
+        return self.strings
+
+    def requires_keywords(self):
+        return True
+
 
 class if_matches:
     def __init__(self, *regexes):
-        self.regexes = list(regexes)
+        self.regexes = list(map(re.compile, regexes))
 
     def __call__(self, string):
-        return any([re.search(rgx, string) is not None for rgx in self.regexes])
+        return any([rgx.search(string) is not None for rgx in self.regexes])
+
+    def evaluate(self, string, hits):
+        return self(string)
+
+    def keywords(self):
+        return []
 
 
 class if_contains_word:
@@ -36,13 +55,35 @@ class if_contains_word:
 
         return False
 
+    def evaluate(self, string, hits):
+        return any(hits.contains_word(word) for word in self.words)
+
+    def keywords(self):
+        return self.words
+
+    def requires_keywords(self):
+        return True
+
+
+# Sentiment polarity of a (normalized) message. Computed lazily by the first rule that needs it; every other rule or
+# response that asks for the same text gets the cached value, as do repeated copypasta and spam messages.
+@functools.lru_cache(maxsize = 4096)
+def message_polarity(string):
+    return polarity(string)
+
 
 class sentiment_less_than:
     def __init__(self, value):
         self.value = value
 
     def __call__(self, string):
-        return TextBlob(string).sentiment.polarity <= self.value
+        return message_polarity(string) <= self.value
+
+    def evaluate(self, string, hits):
+        return self(string)
+
+    def keywords(self):
+        return []
 
 
 class sentiment_more_than:
@@ -50,7 +91,13 @@ class sentiment_more_than:
         self.value = value
 
     def __call__(self, string):
-        return TextBlob(string).sentiment.polarity >= self.value
+        return message_polarity(string) >= self.value
+
+    def evaluate(self, string, hits):
+        return self(string)
+
+    def keywords(self):
+        return []
 
 
 class logical_and:
@@ -60,6 +107,15 @@ class logical_and:
     def __call__(self, string):
         return all([fn(string) for fn in self.fns])
 
+    def evaluate(self, string, hits):
+        return all(evaluate_matcher(fn, string, hits) for fn in self.fns)
+
+    def keywords(self):
+        return [keyword for fn in self.fns for keyword in matcher_keywords(fn)]
+
+    def requires_keywords(self):
+        return any(matcher_requires_keywords(fn) for fn in self.fns)
+
 
 class logical_or:
     def __init__(self, *fns):
@@ -68,10 +124,117 @@ class logical_or:
     def __call__(self, string):
         return any([fn(string) for fn in self.fns])
 
+    def evaluate(self, string, hits):
+        return any(evaluate_matcher(fn, string, hits) for fn in self.fns)
+
+    def keywords(self):
+        return [keyword for fn in self.fns for keyword in matcher_keywords(fn)]
+
+    def requires_keywords(self):
+        return all(matcher_requires_keywords(fn) for fn in self.fns)
+
 
 class logical_not:
     def __init__(self, fn):
         self.fn = fn
 
     def __call__(self, string):
-        return not self.fn(string)
\ No newline at end of file
+        return not self.fn(string)
+
+    def evaluate(self, string, hits):
+        return not evaluate_matcher(self.fn, string, hits)
+
+    def keywords(self):
+        return matcher_keywords(self.fn)
+
+
+# Plain callables (e.g. lambda _: True) don't know about keyword hits, so just call them with the string.
+def evaluate_matcher(matcher, string, hits):
+    if hasattr(matcher, 'evaluate'): return matcher.evaluate(string, hits)
+    else: return matcher(string)
+
+
+def matcher_keywords(matcher):
+    return matcher.keywords() if hasattr(matcher, 'keywords') else []
+
+
+# Whether the matcher can only accept a string if at least one of its keywords occurs in it.
+def matcher_requires_keywords(matcher):
+    return matcher.requires_keywords() if hasattr(matcher, 'requires_keywords') else False
+
+
+# Builds a matcher from its declarative form, e.g. { "or": [{ "contains": ["zedong"] }, { "contains_word": ["mao"] }] }.
+def matcher_from_spec(spec):
+    if not isinstance(spec, dict) or len(spec) != 1:
+        raise ValueError(f'A matcher must be an object with exactly one key, got {spec!r}.')
+
+    (kind, value), = spec.items()
+
+    if kind == 'contains':            return if_contains(*value)
+    if kind == 'contains_word':       return if_contains_word(*value)
+    if kind == 'matches':             return if_matches(*value)
+    if kind == 'sentiment_more_than': return sentiment_more_than(value)
+    if kind == 'sentiment_less_than': return sentiment_less_than(value)
+    if kind == 'and':                 return logical_and(*map(matcher_from_spec, value))
+    if kind == 'or':                  return logical_or(*map(matcher_from_spec, value))
+    if kind == 'not':                 return logical_not(matcher_from_spec(value))
+    if kind == 'always':              return lambda _: bool(value)
+
+    raise ValueError(f'Unknown matcher type {kind}.')
+
+
+# Compiles the literal keywords of a list of (matcher, response) pairs into a single automaton.
+# match(string) returns the response of the first matcher that accepts the string, preserving the list order.
+# Matchers that can only accept a string containing one of their keywords are indexed by those keywords,
+# so they are only evaluated if the automaton found one of them.
+class compiled_matchers:
+    def __init__(self, rules, names = None):
+        self.rules     = list(rules)
+        self.names     = list(names) if names is not None else list(map(str, range(len(self.rules))))
+        self.automaton = keyword_automaton(
+            keyword for matcher, _ in self.rules for keyword in matcher_keywords(matcher)
+        )
+
+        self.unconditional_rules = []
+        self.rules_by_keyword    = dict()
+
+        for index, (matcher, _) in enumerate(self.rules):
+            if not matcher_requires_keywords(matcher):
+                self.unconditional_rules.append(index)
+                continue
+
+            for keyword in matcher_keywords(matcher):
+                self.rules_by_keyword.setdefault(keyword, set()).add(index)
+
+    def scan(self, string):
+        return self.automaton.scan(string)
+
+    def candidate_rules(self, hits):
+        candidates = set(self.unconditional_rules)
+        for keyword in hits.contained: candidates.update(self.rules_by_keyword.get(keyword, ()))
+
+        return sorted(candidates)
+
+    # Returns the index of the first matching rule, or None.
+    # If samples is a list, a (rule index, matched, nanoseconds) tuple is appended to it for every evaluated matcher.
+    def match_index(self, string, hits = None, samples = None):
+        if hits is None: hits = self.scan(string)
+
+        for index in self.candidate_rules(hits):
+            matcher = self.rules[index][0]
+
+            if samples is None:
+                if evaluate_matcher(matcher, string, hits): return index
+                continue
+
+            start   = time.perf_counter_ns()
+            matched = evaluate_matcher(matcher, string, hits)
+            samples.append((index, matched, time.perf_counter_ns() - start))
+
+            if matched: return index
+
+        return None
+
+    def match(self, string, hits = None):
+        index = self.match_index(string, hits)
+        return self.rules[index][1] if index is not None else None
@@ -0,0 +1,70 @@
+import re
+import unicodedata
+
+
+# Characters that render as (nearly) nothing and are used to split up keywords, e.g. 't\u200baiwan'.
+zero_width_characters = [
+    '\u00ad', '\u034f', '\u061c', '\u115f', '\u1160', '\u17b4', '\u17b5', '\u180e', '\u200b', '\u200c', '\u200d',
+    '\u200e', '\u200f', '\u2060', '\u2061', '\u2062', '\u2063', '\u2064', '\u3164', '\ufeff', '\uffa0'
+]
+
+# Lower case letters from other scripts that look identical to latin letters, e.g. the cyrillic 'а' in 'tаiwan'.
+# Applied after NFKC folding and lower casing, so fullwidth / mathematical / upper case variants end up here too.
+# Only replaced in words that also contain latin letters, so words written entirely in cyrillic or greek are left as
+# they are instead of turning into latin gibberish that happens to contain a keyword.
+homoglyphs = {
+    # Cyrillic
+    'а': 'a', 'в': 'b', 'е': 'e', 'ё': 'e', 'һ': 'h', 'і': 'i', 'ї': 'i', 'ј': 'j', 'к': 'k', 'ӏ': 'l', 'м': 'm',
+    'н': 'h', 'о': 'o', 'р': 'p', 'ԛ': 'q', 'ѕ': 's', 'с': 'c', 'т': 't', 'у': 'y', 'ԝ': 'w', 'х': 'x', 'ԁ': 'd',
+    # Greek
+    'α': 'a', 'β': 'b', 'ε': 'e', 'η': 'n', 'ι': 'i', 'κ': 'k', 'ν': 'v', 'ο': 'o', 'ρ': 'p', 'τ': 't', 'υ': 'u',
+    'χ': 'x', 'ω': 'w',
+    # Latin (IPA)
+    'ɑ': 'a', 'ɡ': 'g', 'ı': 'i', 'ɩ': 'i',
+}
+
+zero_width_regex = re.compile('[' + ''.join(zero_width_characters) + ']')
+homoglyph_table  = str.maketrans(homoglyphs)
+
+# Words containing both a homoglyph and a latin letter. The lookaheads only run at the start of every word.
+mixed_word_regex = re.compile(r'\b(?=\w*[' + ''.join(homoglyphs.keys()) + r'])(?=\w*[a-z])\w+')
+
+
+# Every ASCII character that is neither alphanumeric nor whitespace, removed in a single str.translate call.
+ascii_special_table = str.maketrans('', '', ''.join(
+    char for char in map(chr, range(128)) if not char.isalnum() and not char.isspace()
+))
+
+# Anything that isn't alphanumeric or a space. \w also matches '_', which isalnum() does not, so that is removed separately.
+special_regex = re.compile(r'[^\w ]+')
+
+
+# Transform every run of whitespace characters to a single space, keeping leading and trailing whitespace.
+def collapse_whitespace(message):
+    words = message.split()
+    if not words: return ' ' if message else ''
+
+    result = ' '.join(words)
+    if message[0].isspace():  result = ' ' + result
+    if message[-1].isspace(): result = result + ' '
+
+    return result
+
+
+# Make the message lower case, remove special characters and repeated whitespace and transform all whitespace
+# characters to a single space. Non-ASCII messages are NFKC folded first and have zero-width characters and
+# homoglyphs in mixed-script words replaced, so 'Ｔａｉｗａｎ', 't\u200baiwan' and 'tаiwаn' all become 'taiwan'.
+def normalize_message(message):
+    if message.isascii():
+        return collapse_whitespace(message.lower()).translate(ascii_special_table)
+
+    if not unicodedata.is_normalized('NFKC', message):
+        message = unicodedata.normalize('NFKC', message)
+
+    message = message.lower()
+
+    # Zero-width characters first, they would split up the words otherwise.
+    message = zero_width_regex.sub('', message)
+    message = mixed_word_regex.sub(lambda match: match.group().translate(homoglyph_table), message)
+
+    return special_regex.sub('', collapse_whitespace(message)).replace('_', '')
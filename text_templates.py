@@ -0,0 +1,60 @@
+# Text assets (notices, copypasta, patch notes) are read once and kept in memory, with their ${NAME} placeholders
+# already split out, so rendering one is a single join without touching the disk.
+# The file watcher drops a cached file when it changes on disk, and it is read again the next time it's needed.
+
+import re
+from os import path
+from threading import Lock
+
+from file_watcher import watch_file
+
+
+placeholder_pattern = re.compile(r'\$\{(\w+)\}')
+
+
+class text_template:
+    def __init__(self, text):
+        self.text = text
+
+        # Alternating literal text and placeholder names, always starting and ending with literal text.
+        self.parts  = placeholder_pattern.split(text)
+        self.fields = [(index, self.parts[index]) for index in range(1, len(self.parts), 2)]
+
+
+    # Placeholders without a value are left as they are.
+    def render(self, **values):
+        if not self.fields: return self.text
+
+        parts = list(self.parts)
+        for index, name in self.fields:
+            if name in values: parts[index] = str(values[name])
+            else: parts[index] = '${' + name + '}'
+
+        return ''.join(parts)
+
+
+class template_cache:
+    def __init__(self, folder):
+        self.folder    = folder
+        self.templates = dict() # file name => text_template
+        self.watched   = set()
+        self.lock      = Lock()
+
+
+    def get(self, file_name):
+        template = self.templates.get(file_name)
+        if template is not None: return template
+
+        file_path = path.join(self.folder, file_name)
+
+        # Watch the file before reading it, so a change made while reading it isn't missed.
+        with self.lock:
+            if file_name not in self.watched:
+                self.watched.add(file_name)
+                watch_file(file_path, lambda _: self.templates.pop(file_name, None))
+
+        with open(file_path, 'r', encoding = 'utf-8') as handle:
+            template = text_template(handle.read().replace('\r\n', '\n'))
+
+        self.templates[file_name] = template
+        return template
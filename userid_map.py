@@ -1,12 +1,24 @@
+import atexit
 import collections
 import json
 import os
+import time
+from _thread import start_new_thread
+from threading import Lock
 
 from common import asset_folder
 
 
 # Keep track of username => ID mapping because there is no way to perform this conversion in the TG API.
-user_ids = dict()
+# usernames is the reverse index, ID => username.
+user_ids  = dict()
+usernames = dict()
+
+# set_id is called for every message, so changes are only marked here and written out in batches by a background thread.
+ids_lock       = Lock()
+ids_dirty      = False
+flush_interval = 10.0
+flush_running  = False
 
 
 def get_id(username):
@@ -14,18 +26,36 @@ def get_id(username):
     return user_ids[username] if username in user_ids else None
 
 
+def get_username(user_id):
+    global usernames
+    return usernames[user_id] if user_id in usernames else None
+
+
 def set_id(update):
-    global user_ids
+    global user_ids, usernames, ids_dirty
 
+    # Users without a username can't be looked up by username anyway.
     user = update.effective_user
-    if not user: return
+    if not user or user.username is None: return
+
+    # Nothing changed, which is the case for almost every message.
+    if user_ids.get(user.username) == user.id: return
 
-    user_ids[user.username] = user.id
-    save_ids()
+    with ids_lock:
+        # The user changed their username, or the username now belongs to someone else.
+        old_username = usernames.get(user.id)
+        if old_username is not None and old_username != user.username: user_ids.pop(old_username, None)
+
+        old_id = user_ids.get(user.username)
+        if old_id is not None: usernames.pop(old_id, None)
+
+        user_ids[user.username] = user.id
+        usernames[user.id]      = user.username
+        ids_dirty = True
 
 
 def load_ids():
-    global user_ids
+    global user_ids, usernames, flush_running
 
     json_path = os.path.join(asset_folder, 'user_ids.json')
 
@@ -34,14 +64,50 @@ def load_ids():
             handle.write('{}')
 
     with open(json_path, 'r') as handle:
-        user_ids = collections.OrderedDict(map(
-            lambda kv: (str(kv[0]), float(kv[1])),
-            json.load(handle).items()
-        ))
+        # Older versions also stored users without a username, under 'null'.
+        user_ids = collections.OrderedDict(
+            (str(username), int(user_id)) for username, user_id in json.load(handle).items() if username != 'null'
+        )
+
+    usernames = { user_id: username for username, user_id in user_ids.items() }
+
+    if not flush_running:
+        flush_running = True
+        start_new_thread(flush_loop, ())
+        atexit.register(flush_ids)
 
 
-def save_ids():
+# Writes the map to disk if it changed since the last flush.
+def flush_ids():
+    global ids_dirty
+
+    with ids_lock:
+        if not ids_dirty: return
+
+        snapshot  = dict(user_ids)
+        ids_dirty = False
+
+    try: save_ids(snapshot)
+    except:
+        with ids_lock: ids_dirty = True
+        raise
+
+
+def flush_loop():
+    while True:
+        time.sleep(flush_interval)
+
+        try: flush_ids()
+        except Exception as e: print(f'[User IDs]: Failed to save user ids: {e}')
+
+
+def save_ids(ids = None):
     global user_ids
 
-    with open(os.path.join(asset_folder, 'user_ids.json'), 'w') as handle:
-        json.dump(user_ids, handle, indent = 4)
\ No newline at end of file
+    json_path      = os.path.join(asset_folder, 'user_ids.json')
+    temporary_path = json_path + '.tmp'
+
+    with open(temporary_path, 'w') as handle:
+        json.dump(user_ids if ids is None else ids, handle, indent = 4)
+
+    os.replace(temporary_path, json_path)